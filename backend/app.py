@@ -1,7 +1,9 @@
 import os
 import logging
 import nltk
+import orjson
 from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_compress import Compress
 from flask_limiter import Limiter
@@ -88,8 +90,29 @@ bucket = gcs_client.bucket(GCS_BUCKET_NAME)
 # -------------------------------
 # Flask App Configuration
 # -------------------------------
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that parses requests and serializes responses with orjson."""
+    
+    def dumps(self, obj, **kwargs):
+        # Datetimes are passed through to Flask's default handler so they keep
+        # the same HTTP-date format jsonify has always produced
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+class KnowledgeHubFlask(Flask):
+    json_provider_class = OrjsonProvider
+
 def create_app():
-    app = Flask(__name__)
+    app = KnowledgeHubFlask(__name__)
     
     # Initialize CORS
     CORS(app, origins=["*"], supports_credentials=True, methods=["GET", "POST", "OPTIONS", "DELETE", "PUT"])
@@ -113,11 +136,15 @@ def create_app():
         return f"{organization_id}:{request.remote_addr}"
     
     # Initialize rate limiter with organization-aware key function
+    # Counters live in Redis (when configured) so limits hold across workers
+    storage_uri, storage_options = utils.get_rate_limit_storage()
     limiter = Limiter(
         key_func=get_tenant_limit_key,
         app=app,
         default_limits=["300 per day", "60 per hour"],
-        storage_uri="memory://",
+        storage_uri=storage_uri,
+        storage_options=storage_options,
+        strategy="moving-window",
     )
     
     # Exempt webhook routes from rate limiting
@@ -6,7 +6,10 @@ backlog = 2048
 
 # Worker processes
 workers = 2  # Increased from 1 to 2 for better concurrency
-worker_class = 'sync'  # Reverted to 'sync' to avoid gevent monkey patching issues
+# Threaded workers overlap the I/O-bound request waits (Firestore, Pinecone,
+# LLM and WATI calls) without gevent monkey patching, which breaks gRPC
+worker_class = 'gthread'
+threads = 16
 worker_connections = 1000
 timeout = 300  # Increased to 5 minutes to match Cloud Run timeout
 keepalive = 2
@@ -15,6 +18,8 @@ keepalive = 2
 import os
 workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
 timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', worker_class)
+threads = int(os.environ.get('GUNICORN_THREADS', str(threads)))
 
 # Memory management
 max_requests = 1000  # Recycle workers after 1000 requests
@@ -14,6 +14,29 @@ from vector_store import EnhancedPineconeStore
 
 logger = logging.getLogger(__name__)
 
+# QA prompt, parsed once at import and shared by every query
+QA_PROMPT = PromptTemplate.from_template("""
+            You are a helpful, knowledgeable, and friendly AI assistant.
+            
+            Context information:
+            {context}
+            
+            Chat History:
+            {chat_history}
+            
+            User Question: {question}
+            
+            Guidelines:
+            1. Answer the question based on the provided context and conversation history.
+            2. If the context does not fully answer the question, supplement with relevant additional knowledge.
+            3. Use a warm and personable tone with a friendly greeting.
+            4. Structure your response with clear section breaks.
+            5. Use bullet points or numbering for clarity.
+            6. Conclude with a friendly sign-off.
+            
+            Answer:
+            """)
+
 class LangChainRAG:
     """Advanced RAG system using LangChain."""
     
@@ -226,34 +249,13 @@ class LangChainRAG:
                     memory.chat_memory.add_ai_message(ai_msg)
             
             # Create QA chain
-            qa_prompt = PromptTemplate.from_template("""
-            You are a helpful, knowledgeable, and friendly AI assistant.
-            
-            Context information:
-            {context}
-            
-            Chat History:
-            {chat_history}
-            
-            User Question: {question}
-            
-            Guidelines:
-            1. Answer the question based on the provided context and conversation history.
-            2. If the context does not fully answer the question, supplement with relevant additional knowledge.
-            3. Use a warm and personable tone with a friendly greeting.
-            4. Structure your response with clear section breaks.
-            5. Use bullet points or numbering for clarity.
-            6. Conclude with a friendly sign-off.
-            
-            Answer:
-            """)
             
             qa_chain = ConversationalRetrievalChain.from_llm(
                 llm=self.llm,
                 retriever=retriever,
                 memory=memory,
                 return_source_documents=True,
-                combine_docs_chain_kwargs={"prompt": qa_prompt}
+                combine_docs_chain_kwargs={"prompt": QA_PROMPT}
             )
             
             # Execute query
@@ -269,7 +271,7 @@ class LangChainRAG:
                 formatted_history = "\n".join([f"Human: {h}\nAI: {a}" for h, a in chat_history])
                 
                 # Create prompt
-                prompt = qa_prompt.format(
+                prompt = QA_PROMPT.format(
                     context=context_text,
                     chat_history=formatted_history,
                     question=query_text
@@ -6,8 +6,10 @@ It serves as a bridge between the Flask application and the MCP server.
 """
 
 import os
+import atexit
 import logging
 import asyncio
+import threading
 from typing import Dict, List, Any, Optional, Union
 
 # Configure logging
@@ -37,6 +39,66 @@ if not OPENAI_API_KEY or not ANTHROPIC_API_KEY or not PINECONE_API_KEY:
     logger.error(f"Missing required environment variables: {', '.join(missing)}")
     raise EnvironmentError(f"Missing required environment variables: {', '.join(missing)}")
 
+# Persistent event loop shared by all requests in this process
+_background_loop = None
+_background_loop_pid = None
+_background_loop_lock = threading.Lock()
+
+# Process-wide MCP integration instance
+_mcp_integration = None
+_mcp_integration_lock = threading.Lock()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Get the background event loop, starting it on first use in this process."""
+    global _background_loop, _background_loop_pid
+    with _background_loop_lock:
+        # Threads do not survive a fork, so each worker starts its own loop
+        if _background_loop is None or _background_loop_pid != os.getpid():
+            _background_loop = asyncio.new_event_loop()
+            _background_loop_pid = os.getpid()
+            thread = threading.Thread(
+                target=_background_loop.run_forever,
+                name="mcp-event-loop",
+                daemon=True
+            )
+            thread.start()
+        return _background_loop
+
+def run_coroutine(coro, timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the persistent background event loop and wait for its result.
+    
+    Args:
+        coro: The coroutine to run
+        timeout: Maximum number of seconds to wait for the result
+        
+    Returns:
+        The coroutine's result
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_background_loop())
+    try:
+        return future.result(timeout=timeout)
+    except Exception:
+        future.cancel()
+        raise
+
+def get_mcp_integration() -> "MCPIntegration":
+    """Get the process-wide MCP integration, creating it on first use."""
+    global _mcp_integration
+    if _mcp_integration is None:
+        with _mcp_integration_lock:
+            if _mcp_integration is None:
+                _mcp_integration = MCPIntegration()
+    return _mcp_integration
+
+@atexit.register
+def _shutdown():
+    """Close pooled API clients and stop the background event loop."""
+    if _mcp_integration is not None:
+        _mcp_integration.agent_orchestrator.close()
+    if _background_loop is not None and _background_loop_pid == os.getpid():
+        _background_loop.call_soon_threadsafe(_background_loop.stop)
+
 class MCPIntegration:
     """
     MCP Integration
@@ -255,8 +317,8 @@ async def enhance_rag_response(
     if not query or not existing_response:
         raise ValueError("Query and existing response are required")
     
-    # Initialize MCP integration
-    mcp = MCPIntegration()
+    # Reuse the process-wide MCP integration (and its pooled API clients)
+    mcp = get_mcp_integration()
     
     # Extract existing answer and sources
     existing_answer = existing_response.get("answer", "")
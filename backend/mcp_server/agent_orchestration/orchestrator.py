@@ -44,6 +44,10 @@ class AgentOrchestrator:
         self.openai_api_key = openai_api_key
         self.default_model = default_model
         
+        # Anthropic client, created on first use and reused so HTTP
+        # connections are kept alive across requests
+        self._anthropic_client = None
+        
         # Define agent types
         self.agent_types = {
             "retriever": {
@@ -70,6 +74,19 @@ class AgentOrchestrator:
         
         logger.info("Initialized agent orchestrator")
     
+    def _get_anthropic_client(self):
+        """Get the shared Anthropic client, creating it on first use."""
+        if self._anthropic_client is None:
+            import anthropic
+            self._anthropic_client = anthropic.Anthropic(api_key=self.anthropic_api_key)
+        return self._anthropic_client
+    
+    def close(self):
+        """Close the pooled API client connections."""
+        if self._anthropic_client is not None:
+            self._anthropic_client.close()
+            self._anthropic_client = None
+    
     async def orchestrate(
         self,
         task: str,
@@ -356,11 +373,8 @@ class AgentOrchestrator:
             Dict containing the result
         """
         try:
-            # Import Anthropic
-            import anthropic
-            
-            # Create client
-            client = anthropic.Anthropic(api_key=self.anthropic_api_key)
+            # Get the pooled client
+            client = self._get_anthropic_client()
             
             # Get parameters
             max_tokens = execution_parameters.get("max_tokens", 1000)
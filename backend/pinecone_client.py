@@ -1,12 +1,55 @@
 import os
+import threading
 from pinecone import Pinecone, ServerlessSpec
 import logging
 import time
 
+# Prefer the gRPC client, which multiplexes requests over one HTTP/2 channel
+try:
+    from pinecone.grpc import PineconeGRPC as PineconeBaseClient
+except ImportError:
+    PineconeBaseClient = Pinecone
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process-wide Pinecone connections, shared by every organization
+# Format: {(pid, api_key, index_name): (client, index)}
+_shared_connections = {}
+_shared_connections_lock = threading.Lock()
+
+def get_shared_index(api_key, index_name, dimension=3072):
+    """
+    Get the process-wide Pinecone client and index handle, connecting on first use.
+    Tenants share the handle and are isolated by namespace. Connections are
+    keyed by process ID because gRPC channels cannot be used across a fork.
+    """
+    key = (os.getpid(), api_key, index_name)
+    connection = _shared_connections.get(key)
+    if connection is not None:
+        return connection
+    
+    with _shared_connections_lock:
+        connection = _shared_connections.get(key)
+        if connection is None:
+            pc = PineconeBaseClient(api_key=api_key)
+            
+            # Create index if it doesn't exist
+            if index_name not in pc.list_indexes().names():
+                logger.info(f"Creating new index: {index_name}")
+                pc.create_index(
+                    name=index_name,
+                    dimension=dimension,
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud="aws", region="us-east-1")
+                )
+            
+            connection = (pc, pc.Index(index_name))
+            _shared_connections[key] = connection
+            logger.info(f"Successfully connected to Pinecone index: {index_name}")
+        return connection
+
 class PineconeClient:
     def __init__(self, api_key, index_name, dimension=3072, organization_id=None):
         """Initialize Pinecone client with retries."""
@@ -14,34 +57,24 @@ class PineconeClient:
         self.index_name = index_name
         self.dimension = dimension
         self.organization_id = organization_id
-        self.pc = None
-        self.index = None
         self.initialize_with_retry()
 
+    @property
+    def pc(self):
+        """The shared Pinecone client for this process."""
+        return get_shared_index(self.api_key, self.index_name, self.dimension)[0]
+
+    @property
+    def index(self):
+        """The shared index handle for this process."""
+        return get_shared_index(self.api_key, self.index_name, self.dimension)[1]
+
     def initialize_with_retry(self, max_retries=3):
         """Initialize Pinecone with retry logic."""
         for attempt in range(max_retries):
             try:
                 logger.info(f"Initializing Pinecone client, attempt {attempt+1}")
-                # Initialize the client
-                self.pc = Pinecone(api_key=self.api_key)
-                
-                # Check if the index exists
-                indexes = self.pc.list_indexes()
-                
-                # Create index if it doesn't exist
-                if self.index_name not in indexes.names():
-                    logger.info(f"Creating new index: {self.index_name}")
-                    self.pc.create_index(
-                        name=self.index_name,
-                        dimension=self.dimension,
-                        metric="cosine",
-                        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-                    )
-                
-                # Connect to the index
-                self.index = self.pc.Index(self.index_name)
-                logger.info(f"Successfully connected to Pinecone index: {self.index_name}")
+                get_shared_index(self.api_key, self.index_name, self.dimension)
                 return
             
             except Exception as e:
@@ -3,6 +3,7 @@ import logging
 import re
 import threading
 import hashlib
+import functools
 from typing import List, Dict, Any, Callable, Optional
 import anthropic
 import time
@@ -23,6 +24,134 @@ MAX_TOTAL_TOKENS = 30000  # Set a safe limit below the 40,000/min rate limit
 MAX_CONTEXT_TOKENS = 20000  # Reserve tokens for context
 MAX_HISTORY_TOKENS = 8000  # Reserve tokens for history
 
+# Generation settings
+CLAUDE_MODEL = "claude-3-7-sonnet-20250219"
+CLAUDE_MAX_TOKENS = 8000
+CLAUDE_TEMPERATURE = 1
+
+# Conversation summaries use a smaller, cheaper model
+SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+SUMMARY_MAX_TOKENS = 300
+
+# Query classification patterns (compiled once at import)
+FOLLOW_UP_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"what about",
+    r"can you",
+    r"how about",
+    r"tell me more",
+    r"elaborate",
+    r"explain",
+    r"why",
+    r"^and ",
+    r"^but ",
+    r"^so ",
+]]
+
+# Pronouns that suggest a follow-up
+PRONOUN_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"\bthat\b",
+    r"\bit\b",
+    r"\bthis\b",
+    r"\bthese\b",
+    r"\bthose\b",
+    r"\bthem\b",
+]]
+
+CLARIFICATION_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"what do you mean",
+    r"can you clarify",
+    r"don't understand",
+    r"put .* in a table",
+    r"summarize",
+    r"simplify",
+    r"rephrase",
+]]
+
+COMPLEX_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"compare .+ and",
+    r"what are the pros and cons",
+    r"analyze .+ from multiple perspectives",
+    r"summarize .+ different viewpoints",
+    r"explain the relationship between",
+    r"what are the different approaches",
+    r"how does .+ contrast with",
+]]
+
+# Language detection patterns
+NON_LATIN_SCRIPT_PATTERN = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\u1100-\u11FF\u3040-\u309F\u30A0-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF]')
+ARABIC_PATTERN = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]')
+HANGUL_PATTERN = re.compile(r'[\u1100-\u11FF\uAC00-\uD7AF]')
+KANA_PATTERN = re.compile(r'[\u3040-\u309F\u30A0-\u30FF]')
+CJK_PATTERN = re.compile(r'[\u4E00-\u9FFF]')
+THAI_PATTERN = re.compile(r'[\u0E00-\u0E7F]')
+DEVANAGARI_PATTERN = re.compile(r'[\u0900-\u097F]')
+LATIN_DIACRITIC_PATTERN = re.compile(r'[àáâäãåąčćęèéêëėįìíîïłńòóôöõøùúûüųūÿýżźñçšžÀÁÂÄÃÅĄĆČĖĘÈÉÊËÌÍÎÏĮŁŃÒÓÔÖÕØÙÚÛÜŲŪŸÝŻŹÑßÇŒÆŠŽ]')
+
+# Common words used to tell Latin-script languages apart
+LATIN_LANGUAGE_WORDS = [
+    ("fr", ['bonjour', 'merci', 'comment', 'pourquoi', 'quand', 'où']),
+    ("es", ['hola', 'gracias', 'cómo', 'por qué', 'cuándo', 'dónde', 'buenos días', 'buenas tardes', 'buenas noches', 'qué', 'quién', 'cómo']),
+    ("de", ['guten', 'danke', 'wie', 'warum', 'wann', 'wo']),
+    ("it", ['ciao', 'grazie', 'come', 'perché', 'quando', 'dove']),
+    ("pt", ['olá', 'obrigado', 'como', 'por que', 'quando', 'onde']),
+]
+
+# Language-specific instructions
+LANGUAGE_INSTRUCTIONS = {
+    # European languages
+    "fr": "Please respond in French.",
+    "es": "Please respond in Spanish.",
+    "de": "Please respond in German.",
+    "it": "Please respond in Italian.",
+    "pt": "Please respond in Portuguese.",
+    
+    # Middle Eastern languages
+    "ar": "Please respond in Arabic.",
+    "he": "Please respond in Hebrew.",
+    "fa": "Please respond in Farsi/Persian.",
+    
+    # Asian languages
+    "zh": "Please respond in Chinese.",
+    "ja": "Please respond in Japanese.",
+    "ko": "Please respond in Korean.",
+    "hi": "Please respond in Hindi.",
+    "th": "Please respond in Thai.",
+    "vi": "Please respond in Vietnamese.",
+    "id": "Please respond in Indonesian.",
+    "ms": "Please respond in Malay.",
+    
+    # African languages
+    "af": "Please respond in Afrikaans.",
+    "zu": "Please respond in Zulu.",
+    "xh": "Please respond in Xhosa.",
+    "st": "Please respond in Sesotho.",
+    "tn": "Please respond in Setswana.",
+    "sw": "Please respond in Swahili."
+}
+
+RESPONSE_PROMPT_TEMPLATE = """
+        You are a helpful, knowledgeable, and friendly AI assistant.
+        
+        Conversation History:
+        {conversation_history}
+        
+        Context information:
+        ```
+        {context}
+        ```
+        
+        User Question: {query}
+        
+        Guidelines:
+        1. Answer the question based on the provided context and conversation history.
+        2. If the context does not fully answer the question, supplement with relevant additional knowledge.
+        3. Use a warm and personable tone with a friendly greeting.
+        4. Structure your response with clear section breaks.
+        5. Use bullet points or numbering for clarity.
+        6. Conclude with a friendly sign-off.
+        {language_instruction}
+        """
+
 def count_tokens(text: str) -> int:
     """Count tokens in text using tiktoken."""
     if not text:
@@ -53,6 +182,49 @@ def re_rank_matched_docs(query: str, matched_docs: List[Dict[str, Any]]) -> List
                 break
     return ranked_docs
 
+def detect_language(query: str, language: str = "en") -> str:
+    """Detect the response language from the query script, unless one was given."""
+    if language != "en":
+        return language
+    
+    # Check for non-Latin scripts first (Arabic, Chinese, Japanese, Korean, etc.)
+    if NON_LATIN_SCRIPT_PATTERN.search(query):
+        if ARABIC_PATTERN.search(query):
+            return "ar"
+        if HANGUL_PATTERN.search(query):
+            return "ko"
+        if KANA_PATTERN.search(query):
+            return "ja"
+        # Chinese characters (kana and hangul were ruled out above)
+        if CJK_PATTERN.search(query):
+            return "zh"
+        if THAI_PATTERN.search(query):
+            return "th"
+        if DEVANAGARI_PATTERN.search(query):
+            return "hi"
+    # Then check for Latin-based languages with special characters
+    elif LATIN_DIACRITIC_PATTERN.search(query):
+        lowered = query.lower()
+        for code, words in LATIN_LANGUAGE_WORDS:
+            if any(word in lowered for word in words):
+                return code
+    
+    return language
+
+def build_response_prompt(context: str, query: str, conversation_history: str = "", language: str = "en") -> str:
+    """Fill the response prompt template for a query."""
+    language = detect_language(query, language)
+    language_instruction = ""
+    if language != "en":
+        language_instruction = LANGUAGE_INSTRUCTIONS.get(language, f"Please respond in {language}.")
+    
+    return RESPONSE_PROMPT_TEMPLATE.format(
+        conversation_history=conversation_history,
+        context=context,
+        query=query,
+        language_instruction=language_instruction
+    )
+
 class TokenRateLimiter:
     def __init__(self, tokens_per_minute=40000):
         self.tokens_per_minute = tokens_per_minute
@@ -142,6 +314,23 @@ class RAGSystem:
         self.vector_client = self._initialize_vector_client()
         
         self.anthropic_client = anthropic.Client(api_key=self.anthropic_api_key)
+        
+        # Bind the fixed generation arguments once instead of per query
+        self._create_message = functools.partial(
+            self.anthropic_client.messages.create,
+            model=CLAUDE_MODEL,
+            max_tokens=CLAUDE_MAX_TOKENS,
+            temperature=CLAUDE_TEMPERATURE,
+            timeout=self.api_timeout
+        )
+        self._stream_message = functools.partial(
+            self.anthropic_client.messages.stream,
+            model=CLAUDE_MODEL,
+            max_tokens=CLAUDE_MAX_TOKENS,
+            temperature=CLAUDE_TEMPERATURE,
+            timeout=self.api_timeout
+        )
+        
         self.rate_limiter = TokenRateLimiter()
         self.response_cache = ResponseCache()
         
@@ -198,62 +387,19 @@ class RAGSystem:
         
     def _is_follow_up_question(self, query, history):
         """Detect if this is a follow-up question."""
-        follow_up_patterns = [
-            r"(?i)what about",
-            r"(?i)can you",
-            r"(?i)how about",
-            r"(?i)tell me more",
-            r"(?i)elaborate",
-            r"(?i)explain",
-            r"(?i)why",
-            r"(?i)^and ",
-            r"(?i)^but ",
-            r"(?i)^so ",
-        ]
-        
-        # Check for pronouns that suggest follow-up
-        pronoun_patterns = [
-            r"(?i)\bthat\b",
-            r"(?i)\bit\b",
-            r"(?i)\bthis\b",
-            r"(?i)\bthese\b",
-            r"(?i)\bthose\b",
-            r"(?i)\bthem\b",
-        ]
-        
-        # Check if history exists (indicating ongoing conversation)
-        has_history = bool(history.strip())
-        
         # Check for follow-up patterns
-        for pattern in follow_up_patterns:
-            if re.search(pattern, query):
-                return True
-                
-        # Check for pronouns (only if history exists)
-        if has_history:
-            for pattern in pronoun_patterns:
-                if re.search(pattern, query):
-                    return True
-                    
+        if any(pattern.search(query) for pattern in FOLLOW_UP_PATTERNS):
+            return True
+        
+        # Check for pronouns (only if history exists, indicating ongoing conversation)
+        if history.strip():
+            return any(pattern.search(query) for pattern in PRONOUN_PATTERNS)
+        
         return False
 
     def _is_clarification_question(self, query):
         """Detect if this is asking for clarification of previous answer."""
-        clarification_patterns = [
-            r"(?i)what do you mean",
-            r"(?i)can you clarify",
-            r"(?i)don't understand",
-            r"(?i)put .* in a table",
-            r"(?i)summarize",
-            r"(?i)simplify",
-            r"(?i)rephrase",
-        ]
-        
-        for pattern in clarification_patterns:
-            if re.search(pattern, query):
-                return True
-                
-        return False
+        return any(pattern.search(query) for pattern in CLARIFICATION_PATTERNS)
         
     def _truncate_history(self, history, max_tokens):
         """Truncate history while preserving most recent exchanges."""
@@ -309,26 +455,11 @@ class RAGSystem:
 
     def _is_complex_query(self, query):
         """Detect if this is a complex query that would benefit from agent orchestration."""
-        complex_patterns = [
-            r"(?i)compare .+ and",
-            r"(?i)what are the pros and cons",
-            r"(?i)analyze .+ from multiple perspectives",
-            r"(?i)summarize .+ different viewpoints",
-            r"(?i)explain the relationship between",
-            r"(?i)what are the different approaches",
-            r"(?i)how does .+ contrast with",
-        ]
-        
-        for pattern in complex_patterns:
-            if re.search(pattern, query):
-                return True
+        if any(pattern.search(query) for pattern in COMPLEX_PATTERNS):
+            return True
                 
         # Check for multiple questions in one query
-        question_marks = query.count('?')
-        if question_marks > 1:
-            return True
-            
-        return False
+        return query.count('?') > 1
         
     def query(self, user_query, namespace=None, top_k=5, category=None, stream_callback=None, history="", language="en", organization_id=None, user_id=None):
         """
@@ -590,8 +721,11 @@ class RAGSystem:
                     "sources": sources
                 }
         
-        # Check response cache for similar queries
-        context_hash = hashlib.md5(context_text.encode()).hexdigest()
+        # Check response cache for similar queries. One RAGSystem is shared by
+        # every member of an organization, so the key covers everything else
+        # in the prompt: the conversation history and language as well as
+        # the context, or one member's answer could be served to another
+        context_hash = hashlib.md5(f"{language}\0{history}\0{context_text}".encode()).hexdigest()
         cached_response = self.response_cache.get(user_query, context_hash)
         if cached_response:
             logger.info("Using cached response for similar query")
@@ -638,118 +772,28 @@ class RAGSystem:
             }
 
             
+    def summarize_conversation(self, conversation_history):
+        """Condense earlier conversation turns into a short paragraph for later prompts."""
+        prompt = (
+            "Summarize the following conversation between a user and an AI assistant in one short paragraph. "
+            "Keep the topics discussed, key facts and figures, and any open questions, so that follow-up "
+            "questions can be understood. Reply with the summary only.\n\n"
+            f"{conversation_history}"
+        )
+        response = self.anthropic_client.messages.create(
+            model=SUMMARY_MODEL,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0,
+            timeout=self.api_timeout,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return response.content[0].text.strip()
+
     def generate_response(self, context, query, callback: Callable[[str], None], conversation_history="", language="en"):
-        # Detect language if not provided
-        if language == "en":
-            # Check for non-Latin scripts first (Arabic, Chinese, Japanese, Korean, etc.)
-            if re.search(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\u1100-\u11FF\u3040-\u309F\u30A0-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF]', query):
-                # Arabic script
-                if re.search(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]', query):
-                    language = "ar"  # Arabic
-                # Korean Hangul
-                elif re.search(r'[\u1100-\u11FF\uAC00-\uD7AF]', query):
-                    language = "ko"  # Korean
-                # Japanese Hiragana/Katakana
-                elif re.search(r'[\u3040-\u309F\u30A0-\u30FF]', query):
-                    language = "ja"  # Japanese
-                # Chinese characters (also used in Japanese and Korean)
-                elif re.search(r'[\u4E00-\u9FFF]', query):
-                    # Simple heuristic: if there are Hiragana/Katakana, it's Japanese
-                    if re.search(r'[\u3040-\u309F\u30A0-\u30FF]', query):
-                        language = "ja"  # Japanese
-                    # If there are Hangul characters, it's Korean
-                    elif re.search(r'[\uAC00-\uD7AF]', query):
-                        language = "ko"  # Korean
-                    # Otherwise, assume Chinese
-                    else:
-                        language = "zh"  # Chinese
-                # Thai script
-                elif re.search(r'[\u0E00-\u0E7F]', query):
-                    language = "th"  # Thai
-                # Hindi/Devanagari script
-                elif re.search(r'[\u0900-\u097F]', query):
-                    language = "hi"  # Hindi
-            # Then check for Latin-based languages with special characters
-            elif re.search(r'[àáâäãåąčćęèéêëėįìíîïłńòóôöõøùúûüųūÿýżźñçšžÀÁÂÄÃÅĄĆČĖĘÈÉÊËÌÍÎÏĮŁŃÒÓÔÖÕØÙÚÛÜŲŪŸÝŻŹÑßÇŒÆŠŽ]', query):
-                # Check for common words in various languages
-                if any(word in query.lower() for word in ['bonjour', 'merci', 'comment', 'pourquoi', 'quand', 'où']):
-                    language = "fr"  # French
-                elif any(word in query.lower() for word in ['hola', 'gracias', 'cómo', 'por qué', 'cuándo', 'dónde', 'buenos días', 'buenas tardes', 'buenas noches', 'qué', 'quién', 'cómo']):
-                    language = "es"  # Spanish
-                elif any(word in query.lower() for word in ['guten', 'danke', 'wie', 'warum', 'wann', 'wo']):
-                    language = "de"  # German
-                elif any(word in query.lower() for word in ['ciao', 'grazie', 'come', 'perché', 'quando', 'dove']):
-                    language = "it"  # Italian
-                elif any(word in query.lower() for word in ['olá', 'obrigado', 'como', 'por que', 'quando', 'onde']):
-                    language = "pt"  # Portuguese
-        
-        # Language-specific instructions
-        language_instruction = ""
-        if language != "en":
-            language_map = {
-                # European languages
-                "fr": "Please respond in French.",
-                "es": "Please respond in Spanish.",
-                "de": "Please respond in German.",
-                "it": "Please respond in Italian.",
-                "pt": "Please respond in Portuguese.",
-                
-                # Middle Eastern languages
-                "ar": "Please respond in Arabic.",
-                "he": "Please respond in Hebrew.",
-                "fa": "Please respond in Farsi/Persian.",
-                
-                # Asian languages
-                "zh": "Please respond in Chinese.",
-                "ja": "Please respond in Japanese.",
-                "ko": "Please respond in Korean.",
-                "hi": "Please respond in Hindi.",
-                "th": "Please respond in Thai.",
-                "vi": "Please respond in Vietnamese.",
-                "id": "Please respond in Indonesian.",
-                "ms": "Please respond in Malay.",
-                
-                # African languages
-                "af": "Please respond in Afrikaans.",
-                "zu": "Please respond in Zulu.",
-                "xh": "Please respond in Xhosa.",
-                "st": "Please respond in Sesotho.",
-                "tn": "Please respond in Setswana.",
-                "sw": "Please respond in Swahili."
-            }
-            language_instruction = language_map.get(language, f"Please respond in {language}.")
-        
-        prompt = f"""
-        You are a helpful, knowledgeable, and friendly AI assistant.
-        
-        Conversation History:
-        {conversation_history}
-        
-        Context information:
-        ```
-        {context}
-        ```
-        
-        User Question: {query}
-        
-        Guidelines:
-        1. Answer the question based on the provided context and conversation history.
-        2. If the context does not fully answer the question, supplement with relevant additional knowledge.
-        3. Use a warm and personable tone with a friendly greeting.
-        4. Structure your response with clear section breaks.
-        5. Use bullet points or numbering for clarity.
-        6. Conclude with a friendly sign-off.
-        {language_instruction}
-        """
+        prompt = build_response_prompt(context, query, conversation_history, language)
         
         try:
-            response = self.anthropic_client.messages.create(
-                model="claude-3-7-sonnet-20250219",
-                max_tokens=8000,
-                temperature=1,
-                messages=[{"role": "user", "content": prompt}],
-                timeout=self.api_timeout  # Add timeout for API calls
-            )
+            response = self._create_message(messages=[{"role": "user", "content": prompt}])
             full_text = response.content[0].text
             chunk_size = 10
             for i in range(0, len(full_text), chunk_size):
@@ -763,119 +807,12 @@ class RAGSystem:
             raise
 
     def generate_streaming_response(self, context, query, callback: Callable[[str], None], conversation_history="", language="en"):
-        # Detect language if not provided
-        if language == "en":
-            # Check for non-Latin scripts first (Arabic, Chinese, Japanese, Korean, etc.)
-            if re.search(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\u1100-\u11FF\u3040-\u309F\u30A0-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF]', query):
-                # Arabic script
-                if re.search(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]', query):
-                    language = "ar"  # Arabic
-                # Korean Hangul
-                elif re.search(r'[\u1100-\u11FF\uAC00-\uD7AF]', query):
-                    language = "ko"  # Korean
-                # Japanese Hiragana/Katakana
-                elif re.search(r'[\u3040-\u309F\u30A0-\u30FF]', query):
-                    language = "ja"  # Japanese
-                # Chinese characters (also used in Japanese and Korean)
-                elif re.search(r'[\u4E00-\u9FFF]', query):
-                    # Simple heuristic: if there are Hiragana/Katakana, it's Japanese
-                    if re.search(r'[\u3040-\u309F\u30A0-\u30FF]', query):
-                        language = "ja"  # Japanese
-                    # If there are Hangul characters, it's Korean
-                    elif re.search(r'[\uAC00-\uD7AF]', query):
-                        language = "ko"  # Korean
-                    # Otherwise, assume Chinese
-                    else:
-                        language = "zh"  # Chinese
-                # Thai script
-                elif re.search(r'[\u0E00-\u0E7F]', query):
-                    language = "th"  # Thai
-                # Hindi/Devanagari script
-                elif re.search(r'[\u0900-\u097F]', query):
-                    language = "hi"  # Hindi
-            # Then check for Latin-based languages with special characters
-            elif re.search(r'[àáâäãåąčćęèéêëėįìíîïłńòóôöõøùúûüųūÿýżźñçšžÀÁÂÄÃÅĄĆČĖĘÈÉÊËÌÍÎÏĮŁŃÒÓÔÖÕØÙÚÛÜŲŪŸÝŻŹÑßÇŒÆŠŽ]', query):
-                # Check for common words in various languages
-                if any(word in query.lower() for word in ['bonjour', 'merci', 'comment', 'pourquoi', 'quand', 'où']):
-                    language = "fr"  # French
-                elif any(word in query.lower() for word in ['hola', 'gracias', 'cómo', 'por qué', 'cuándo', 'dónde', 'buenos días', 'buenas tardes', 'buenas noches', 'qué', 'quién', 'cómo']):
-                    language = "es"  # Spanish
-                elif any(word in query.lower() for word in ['guten', 'danke', 'wie', 'warum', 'wann', 'wo']):
-                    language = "de"  # German
-                elif any(word in query.lower() for word in ['ciao', 'grazie', 'come', 'perché', 'quando', 'dove']):
-                    language = "it"  # Italian
-                elif any(word in query.lower() for word in ['olá', 'obrigado', 'como', 'por que', 'quando', 'onde']):
-                    language = "pt"  # Portuguese
-        
-        # Language-specific instructions
-        language_instruction = ""
-        if language != "en":
-            language_map = {
-                # European languages
-                "fr": "Please respond in French.",
-                "es": "Please respond in Spanish.",
-                "de": "Please respond in German.",
-                "it": "Please respond in Italian.",
-                "pt": "Please respond in Portuguese.",
-                
-                # Middle Eastern languages
-                "ar": "Please respond in Arabic.",
-                "he": "Please respond in Hebrew.",
-                "fa": "Please respond in Farsi/Persian.",
-                
-                # Asian languages
-                "zh": "Please respond in Chinese.",
-                "ja": "Please respond in Japanese.",
-                "ko": "Please respond in Korean.",
-                "hi": "Please respond in Hindi.",
-                "th": "Please respond in Thai.",
-                "vi": "Please respond in Vietnamese.",
-                "id": "Please respond in Indonesian.",
-                "ms": "Please respond in Malay.",
-                
-                # African languages
-                "af": "Please respond in Afrikaans.",
-                "zu": "Please respond in Zulu.",
-                "xh": "Please respond in Xhosa.",
-                "st": "Please respond in Sesotho.",
-                "tn": "Please respond in Setswana.",
-                "sw": "Please respond in Swahili."
-            }
-            language_instruction = language_map.get(language, f"Please respond in {language}.")
-        
-        prompt = f"""
-        You are a helpful, knowledgeable, and friendly AI assistant.
-        
-        Conversation History:
-        {conversation_history}
-        
-        Context information:
-        ```
-        {context}
-        ```
-        
-        User Question: {query}
-        
-        Guidelines:
-        1. Answer the question based on the provided context and conversation history.
-        2. If the context does not fully answer the question, supplement with additional relevant knowledge.
-        3. Use a warm and personable tone with a friendly greeting.
-        4. Structure your response with clear section breaks.
-        5. Use bullet points or numbering for clarity.
-        6. Conclude with a friendly sign-off.
-        {language_instruction}
-        """
+        prompt = build_response_prompt(context, query, conversation_history, language)
         
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                with self.anthropic_client.messages.stream(
-                    model="claude-3-7-sonnet-20250219",
-                    max_tokens=8000,
-                    temperature=1,
-                    messages=[{"role": "user", "content": prompt}],
-                    timeout=self.api_timeout  # Add timeout for streaming API calls
-                ) as stream:
+                with self._stream_message(messages=[{"role": "user", "content": prompt}]) as stream:
                     for chunk in stream:
                         if chunk.type == "content_block_delta" and chunk.delta.text:
                             callback(chunk.delta.text)
@@ -4,7 +4,7 @@ import time
 import logging
 from flask import Blueprint, request, jsonify
 from firebase_admin import auth, firestore, exceptions
-from pinecone import Pinecone as PineconeClient
+from pinecone_client import get_shared_index
 from vector_store import EnhancedPineconeStore
 
 # Configure logging
@@ -351,9 +351,6 @@ def create_organization():
             pinecone_index_name = os.environ.get("PINECONE_INDEX_NAME", "knowledge-hub-vectors")
             
             if pinecone_api_key:
-                # Initialize Pinecone client
-                pc = PineconeClient(api_key=pinecone_api_key)
-                
                 # Initialize vector store with the new organization ID
                 vector_store = EnhancedPineconeStore(
                     api_key=pinecone_api_key,
@@ -375,8 +372,8 @@ def create_organization():
                     }
                 }
                 
-                # Get the index
-                index = pc.Index(pinecone_index_name)
+                # Get the shared index handle
+                _, index = get_shared_index(pinecone_api_key, pinecone_index_name)
                 
                 # Insert the dummy document to create the namespace
                 namespace = f"org_{org_id}"
@@ -5,7 +5,7 @@ from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
 from firebase_admin import firestore
 from document_loaders import DocumentLoaderFactory
-from rag_system import RAGSystem
+from routes.query_routes import get_rag_system
 from pinecone_client import PineconeClient
 from utils import allowed_file, get_user_organization_id
 
@@ -114,14 +114,8 @@ def upload_document():
         
         # Process with custom RAG system
         try:
-            # Initialize organization-specific RAG system
-            rag_system = RAGSystem(
-                openai_api_key=OPENAI_API_KEY,
-                anthropic_api_key=ANTHROPIC_API_KEY,
-                pinecone_api_key=PINECONE_API_KEY,
-                index_name=PINECONE_INDEX_NAME,
-                organization_id=organization_id
-            )
+            # Get the organization-specific RAG system (shared with the query routes)
+            rag_system = get_rag_system("custom", organization_id)
             
             # Extract text and metadata first
             text, metadata, _ = DocumentLoaderFactory.extract_text_and_metadata(local_path)
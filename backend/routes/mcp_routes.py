@@ -16,7 +16,8 @@ import asyncio
 from mcp_integration import (
     MCPIntegration,
     enhance_rag_response,
-    process_document_with_enhanced_chunking
+    process_document_with_enhanced_chunking,
+    run_coroutine
 )
 
 # Configure logging
@@ -381,11 +382,8 @@ def enhance_response():
                 logger.error(f"Error enhancing response: {str(e)}")
                 raise
         
-        # Run the enhancement
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(run_enhancement())
-        loop.close()
+        # Run the enhancement on the shared background event loop
+        result = run_coroutine(run_enhancement())
         
         # Return the result
         return jsonify({
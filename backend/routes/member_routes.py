@@ -3,11 +3,11 @@ import os
 import json
 from flask import Blueprint, request, jsonify
 from firebase_admin import firestore
-import uuid
 from datetime import datetime, timedelta
 import re
 from auth_routes import verify_token
 import utils
+from routes.whatsapp_routes import get_organization_name, invalidate_member, to_wati_phone, verification_expired
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,18 +18,20 @@ db = firestore.client()
 # Create blueprint
 member_bp = Blueprint('members', __name__, url_prefix='/members')
 
+# Validation patterns (compiled once at import)
+# Basic validation for international phone numbers:
+# country code with + prefix and digits
+PHONE_PATTERN = re.compile(r'^\+\d{1,3}\d{6,14}$')
+# Basic email validation
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 # Helper function to validate phone number
 def is_valid_phone(phone):
-    # Basic validation for international phone numbers
-    # Allows for country code with + prefix and digits
-    pattern = r'^\+\d{1,3}\d{6,14}$'
-    return bool(re.match(pattern, phone))
+    return bool(PHONE_PATTERN.match(phone))
 
 # Helper function to validate email
 def is_valid_email(email):
-    # Basic email validation
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, email))
+    return bool(EMAIL_PATTERN.match(email))
 
 # Get all members for the current user's organization
 @member_bp.route('', methods=['GET'])
@@ -113,7 +115,8 @@ def add_member():
             return jsonify({'error': 'A member with this phone number already exists'}), 400
         
         # Create the member
-        member_id = str(uuid.uuid4())
+        member_ref = members_ref.document()
+        member_id = member_ref.id
         member_data = {
             'name': data.get('name', ''),
             'email': data.get('email'),
@@ -128,7 +131,8 @@ def add_member():
         }
         
         # Add the member to Firestore
-        members_ref.document(member_id).set(member_data)
+        member_ref.set(member_data)
+        invalidate_member(data.get('phone'))
         
         # Return the member data
         member_data['id'] = member_id
@@ -156,9 +160,9 @@ def update_member(member_id):
             logger.error("User ID is required for updating members")
             return jsonify({'error': 'User ID is required. Please ensure you are properly authenticated.'}), 403
         
-        # Get the member from Firestore
+        # Get the member from Firestore (only the fields this route reads)
         members_ref = db.collection('members')
-        member_doc = members_ref.document(member_id).get()
+        member_doc = members_ref.document(member_id).get(field_paths=['organizationId'])
         
         if not member_doc.exists:
             return jsonify({'error': 'Member not found'}), 404
@@ -217,9 +221,9 @@ def delete_member(member_id):
             logger.error("User ID is required for deleting members")
             return jsonify({'error': 'User ID is required. Please ensure you are properly authenticated.'}), 403
         
-        # Get the member from Firestore
+        # Get the member from Firestore (only the fields this route reads)
         members_ref = db.collection('members')
-        member_doc = members_ref.document(member_id).get()
+        member_doc = members_ref.document(member_id).get(field_paths=['organizationId', 'phone'])
         
         if not member_doc.exists:
             return jsonify({'error': 'Member not found'}), 404
@@ -233,6 +237,10 @@ def delete_member(member_id):
         # Delete the member from Firestore
         members_ref.document(member_id).delete()
         
+        # Stop answering WhatsApp messages from the cached member lookup
+        if member_data.get('phone'):
+            invalidate_member(member_data['phone'])
+        
         return jsonify({'memberId': member_id}), 200
         
     except Exception as e:
@@ -273,9 +281,9 @@ def send_whatsapp_verification():
         if not member_id:
             return jsonify({'error': 'Member ID is required'}), 400
         
-        # Get the member from Firestore
+        # Get the member from Firestore (only the fields this route reads)
         members_ref = db.collection('members')
-        member_doc = members_ref.document(member_id).get()
+        member_doc = members_ref.document(member_id).get(field_paths=['organizationId', 'phone', 'name'])
         
         if not member_doc.exists:
             return jsonify({'error': 'Member not found'}), 404
@@ -291,20 +299,10 @@ def send_whatsapp_verification():
             wati_client = get_wati_client()
             
             # Format the phone number (must be E.164 format without the + prefix for WATI)
-            to_number = member_data.get('phone')
-            # Remove whatsapp: prefix if present
-            if to_number.startswith('whatsapp:'):
-                to_number = to_number[9:]
-            # Remove + prefix for WATI
-            if to_number.startswith('+'):
-                to_number = to_number[1:]
+            to_number = to_wati_phone(member_data.get('phone'))
             
             # Get organization name
-            org_name = "Knowledge Hub"
-            org_doc = db.collection('organizations').document(organization_id).get()
-            if org_doc.exists:
-                org_data = org_doc.to_dict()
-                org_name = org_data.get('name', org_name)
+            org_name = get_organization_name(organization_id, "Knowledge Hub")
             
             # Generate verification code
             verification_code = generate_verification_code(6)
@@ -318,6 +316,7 @@ def send_whatsapp_verification():
             members_ref.document(member_id).update({
                 'verificationCode': verification_code,
                 'verificationExpiry': verification_expiry.isoformat(),
+                'verificationExpiryTs': int(verification_expiry.timestamp()),
                 'verificationSent': True,
                 'verificationSentAt': firestore.SERVER_TIMESTAMP,
                 'updatedAt': firestore.SERVER_TIMESTAMP,
@@ -393,9 +392,9 @@ def verify_whatsapp_code():
         if not member_id or not verification_code:
             return jsonify({'error': 'Member ID and verification code are required'}), 400
         
-        # Get the member from Firestore
+        # Get the member from Firestore (only the fields this route reads)
         members_ref = db.collection('members')
-        member_doc = members_ref.document(member_id).get()
+        member_doc = members_ref.document(member_id).get(field_paths=['organizationId', 'phone', 'verificationSent', 'verificationCode', 'verificationExpiry', 'verificationExpiryTs'])
         
         if not member_doc.exists:
             return jsonify({'error': 'Member not found'}), 404
@@ -412,15 +411,15 @@ def verify_whatsapp_code():
         
         # Check if verification code matches and is not expired
         stored_code = member_data.get('verificationCode')
+        expiry_ts = member_data.get('verificationExpiryTs')
         expiry_str = member_data.get('verificationExpiry')
         
-        if not stored_code or not expiry_str:
+        if not stored_code or not (expiry_ts or expiry_str):
             return jsonify({'error': 'No verification code or expiry found for this member'}), 400
         
         # Check if code is expired
         try:
-            expiry = datetime.fromisoformat(expiry_str)
-            if datetime.now() > expiry:
+            if verification_expired(expiry_ts, expiry_str):
                 return jsonify({'error': 'Verification code has expired. Please request a new code.'}), 400
         except Exception as e:
             logger.error(f"Error parsing expiry date: {str(e)}")
@@ -436,22 +435,10 @@ def verify_whatsapp_code():
             wati_client = get_wati_client()
             
             # Format the phone number for WATI
-            to_number = member_data.get('phone')
-            # Remove whatsapp: prefix if present
-            if to_number.startswith('whatsapp:'):
-                to_number = to_number[9:]
-            # Remove + prefix for WATI
-            if to_number.startswith('+'):
-                wati_phone = to_number[1:]
-            else:
-                wati_phone = to_number
+            wati_phone = to_wati_phone(member_data.get('phone'))
             
             # Get organization name
-            org_name = "Knowledge Hub"
-            org_doc = db.collection('organizations').document(organization_id).get()
-            if org_doc.exists:
-                org_data = org_doc.to_dict()
-                org_name = org_data.get('name', org_name)
+            org_name = get_organization_name(organization_id, "Knowledge Hub")
             
             # Mark the member as verified
             members_ref.document(member_id).update({
@@ -461,6 +448,7 @@ def verify_whatsapp_code():
                 'updatedAt': firestore.SERVER_TIMESTAMP,
                 'updatedBy': user_id
             })
+            invalidate_member(wati_phone)
             
             # Send welcome message using template
             try:
@@ -1,11 +1,14 @@
 import os
 import logging
 import traceback
-from flask import Blueprint, request, jsonify, current_app
+import importlib
+import hashlib
+import threading
+from functools import lru_cache
+from flask import Blueprint, Response, request, jsonify, current_app
 from firebase_admin import firestore
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from rag_system import RAGSystem
 import utils
 import requests
 
@@ -29,10 +32,13 @@ def get_tenant_limit_key():
     return f"{organization_id}:{request.remote_addr}"
 
 # Initialize limiter for this blueprint with organization-aware key function
+storage_uri, storage_options = utils.get_rate_limit_storage()
 limiter = Limiter(
     key_func=get_tenant_limit_key,
     default_limits=["150 per day", "30 per hour"],
-    storage_uri="memory://"
+    storage_uri=storage_uri,
+    storage_options=storage_options,
+    strategy="moving-window"
 )
 
 # Get environment variables
@@ -41,6 +47,109 @@ ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "knowledge-hub-vectors")
 
+def run_custom_query(rag, query_text, history, stream_callback=None):
+    """Run a query against the custom RAGSystem backend."""
+    return rag.query(user_query=query_text, history=history, stream_callback=stream_callback)
+
+def run_langchain_query(rag, query_text, history, stream_callback=None):
+    """Run a query against the LangChainRAG backend."""
+    return rag.query(query_text=query_text, history=history, stream_callback=stream_callback)
+
+# RAG backend dispatch table: name -> (module, class name, query adapter)
+RAG_BACKENDS = {
+    "custom": ("rag_system", "RAGSystem", run_custom_query),
+    "langchain": ("langchain_rag", "LangChainRAG", run_langchain_query),
+}
+
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "custom")
+if RAG_BACKEND not in RAG_BACKENDS:
+    logger.warning(f"Unknown RAG_BACKEND '{RAG_BACKEND}', using 'custom'")
+    RAG_BACKEND = "custom"
+
+@lru_cache(maxsize=None)
+def get_rag_backend(name):
+    """Import a RAG backend on first use and return its class and query adapter."""
+    module_name, class_name, run_query = RAG_BACKENDS[name]
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name), run_query
+
+# One lock per (backend, organization), so concurrent first requests for an
+# organization build one instance instead of racing to build several, while
+# a slow cold build never holds up requests for other organizations
+rag_build_locks = {}
+rag_build_locks_lock = threading.Lock()
+
+def get_rag_system(backend, organization_id):
+    """Get an organization's RAG system for a backend, built once per process and reused across queries."""
+    key = (backend, organization_id)
+    with rag_build_locks_lock:
+        build_lock = rag_build_locks.get(key)
+        if build_lock is None:
+            build_lock = rag_build_locks[key] = threading.Lock()
+    with build_lock:
+        return build_rag_system(backend, organization_id)
+
+# One instance serves every user of an organization, so per-user input such
+# as the conversation history must never be kept on it: RAGSystem's response
+# cache is keyed on the history along with the query and context, and
+# LangChainRAG keeps no response cache
+@lru_cache(maxsize=32)
+def build_rag_system(backend, organization_id):
+    """Build an organization's RAG system for a backend (cached; use get_rag_system)."""
+    rag_cls, _ = get_rag_backend(backend)
+    return rag_cls(
+        openai_api_key=OPENAI_API_KEY,
+        anthropic_api_key=ANTHROPIC_API_KEY,
+        pinecone_api_key=PINECONE_API_KEY,
+        index_name=PINECONE_INDEX_NAME,
+        organization_id=organization_id
+    )
+
+# Chat session settings
+MESSAGES_PAGE_SIZE = 50
+MAX_BATCH_WRITES = 500
+
+# Error messages for unauthenticated or unassigned users
+ORG_REQUIRED_ERROR = "Organization ID is required. Please ensure you are properly authenticated and assigned to an organization."
+USER_REQUIRED_ERROR = "User ID is required. Please ensure you are properly authenticated."
+
+def error_response(message, status):
+    """Build a JSON error response tuple."""
+    return jsonify({"error": message}), status
+
+def require_org_and_user(action, require_user=True):
+    """
+    Resolve the authenticated user's organization and user IDs.
+    
+    Returns (organization_id, user_id, None), or (None, None, error response)
+    when either ID is missing.
+    """
+    # Enforce organization ID requirement for multi-tenant isolation
+    organization_id = utils.get_user_organization_id()
+    if not organization_id:
+        logger.error(f"Organization ID is required for {action}")
+        return None, None, error_response(ORG_REQUIRED_ERROR, 403)
+    
+    user_id = utils.get_user_id() if require_user else None
+    if require_user and not user_id:
+        logger.error(f"User ID is required for {action}")
+        return None, None, error_response(USER_REQUIRED_ERROR, 403)
+    
+    return organization_id, user_id, None
+
+def make_etag(*parts):
+    """Build an ETag value from the parts a response depends on."""
+    return hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+
+def get_message_count(session_ref, session_data):
+    """Count the messages in a chat session with a server-side aggregation query."""
+    # Sessions saved before messages moved to a subcollection
+    if "messages" in session_data:
+        return len(session_data["messages"])
+    
+    result = session_ref.collection("messages").count().get()
+    return result[0][0].value
+
 @query_bp.route('/query', methods=['POST'])
 @limiter.limit("10 per minute")  # Stricter limit for the query endpoint
 def query():
@@ -52,27 +161,25 @@ def query():
     conversation_history = data.get("history", "")
     
     # Log the auth header for debugging
-    auth_header = request.headers.get('Authorization')
-    logger.info(f"Auth header present: {bool(auth_header)}")
-    if auth_header:
-        logger.info(f"Auth header format valid: {auth_header.startswith('Bearer ')}")
+    if logger.isEnabledFor(logging.DEBUG):
+        auth_header = request.headers.get('Authorization')
+        logger.debug("Auth header present: %s, format valid: %s",
+                     bool(auth_header), bool(auth_header) and auth_header.startswith('Bearer '))
     
     # Get organization ID from authenticated user
-    organization_id = utils.get_user_organization_id()
+    organization_id, _, error = require_org_and_user("querying", require_user=False)
+    if error:
+        return error
     
-    # Enforce organization ID requirement for multi-tenant isolation
-    if not organization_id:
-        logger.error("Organization ID is required for querying")
-        return jsonify({"error": "Organization ID is required. Please ensure you are properly authenticated and assigned to an organization."}), 403
-    
-    logger.info(f"Query received: '{query_text}', category: '{category}', stream: {stream_enabled}, organization: {organization_id}")
+    logger.info("Query received: '%s', category: '%s', stream: %s, organization: %s",
+                query_text, category, stream_enabled, organization_id)
     
     if not query_text or not isinstance(query_text, str) or len(query_text.strip()) < 2:
-        return jsonify({"error": "Invalid or empty query"}), 400
+        return error_response("Invalid or empty query", 400)
 
     try:
-        # Log query to Firestore
-        db.collection("queries").add({
+        # Log query to Firestore without blocking the RAG call
+        utils.submit_background(db.collection("queries").add, {
             "query": query_text,
             "category": category,
             "timestamp": firestore.SERVER_TIMESTAMP,
@@ -82,29 +189,20 @@ def query():
             "organizationId": organization_id
         })
         
-        # Initialize organization-specific RAG system
-        rag_system = RAGSystem(
-            openai_api_key=OPENAI_API_KEY,
-            anthropic_api_key=ANTHROPIC_API_KEY,
-            pinecone_api_key=PINECONE_API_KEY,
-            index_name=PINECONE_INDEX_NAME,
-            organization_id=organization_id
-        )
+        # Get the cached organization-specific RAG system for the configured backend
+        _, run_query = get_rag_backend(RAG_BACKEND)
+        rag_system = get_rag_system(RAG_BACKEND, organization_id)
         
         if not stream_enabled:
             # Non-streaming response
-            result = rag_system.query(
-                user_query=query_text,
-                history=conversation_history
-            )
+            result = run_query(rag_system, query_text, conversation_history)
             
             # Check if enhancement is requested or enabled by default
             if data.get("enhance", True):
-                from mcp_integration import enhance_rag_response
-                import asyncio
+                from mcp_integration import enhance_rag_response, run_coroutine
                 
                 try:
-                    enhanced_result = asyncio.run(enhance_rag_response(
+                    enhanced_result = run_coroutine(enhance_rag_response(
                         query=query_text,
                         existing_response=result,
                         conversation_history=conversation_history
@@ -140,9 +238,10 @@ def query():
                     accumulated_response += chunk
                 
                 try:
-                    result = rag_system.query(
-                        user_query=query_text,
-                        history=conversation_history,
+                    result = run_query(
+                        rag_system,
+                        query_text,
+                        conversation_history,
                         stream_callback=stream_callback
                     )
                     
@@ -171,17 +270,9 @@ def query():
 def get_chat_history():
     """Get chat history for the current user."""
     # Get organization ID and user ID from authenticated user
-    organization_id = utils.get_user_organization_id()
-    user_id = utils.get_user_id()
-    
-    # Enforce organization ID requirement for multi-tenant isolation
-    if not organization_id:
-        logger.error("Organization ID is required for chat history")
-        return jsonify({"error": "Organization ID is required. Please ensure you are properly authenticated and assigned to an organization."}), 403
-    
-    if not user_id:
-        logger.error("User ID is required for chat history")
-        return jsonify({"error": "User ID is required. Please ensure you are properly authenticated."}), 403
+    organization_id, user_id, error = require_org_and_user("chat history")
+    if error:
+        return error
     
     try:
         # Query Firestore for chat sessions
@@ -189,27 +280,36 @@ def get_chat_history():
                 .collection("users").document(user_id) \
                 .collection("chat_sessions").order_by("updated_at", direction=firestore.Query.DESCENDING)
         
-        # Execute query
-        sessions = query.stream()
+        # Every save bumps updated_at, so the newest value identifies this
+        # version of the history; answer 304 without reading the sessions
+        latest = list(query.limit(1).select(["updated_at"]).stream())
+        latest_update = latest[0].to_dict().get("updated_at") if latest else None
+        etag = make_etag(organization_id, user_id, latest_update)
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304)
         
-        # Format results
-        results = []
-        for session in sessions:
+        # Build every session record (including its message count) before
+        # responding, so a failed read is reported with a 500 instead of a
+        # truncated list that would then be cached under the ETag
+        sessions = []
+        for session in query.stream():
             session_data = session.to_dict()
-            results.append({
+            sessions.append({
                 "id": session.id,
                 "title": session_data.get("title", "Untitled Chat"),
                 "last_message": session_data.get("last_message", ""),
                 "updated_at": session_data.get("updated_at"),
                 "created_at": session_data.get("created_at"),
                 "category": session_data.get("category", "general"),
-                "message_count": len(session_data.get("messages", []))
+                "message_count": get_message_count(session.reference, session_data)
             })
         
-        return jsonify({"sessions": results})
+        response = jsonify({"sessions": sessions})
+        response.set_etag(etag, weak=True)
+        return response
     except Exception as e:
         logger.error(f"Chat history error: {str(e)}")
-        return jsonify({"error": f"Failed to retrieve chat history: {str(e)}"}), 500
+        return error_response(f"Failed to retrieve chat history: {str(e)}", 500)
 
 @query_bp.route('/chat/save', methods=['POST'])
 def save_chat_session():
@@ -217,62 +317,82 @@ def save_chat_session():
     data = request.get_json()
     session_id = data.get("session_id")
     title = data.get("title", "Untitled Chat")
-    messages = data.get("messages", [])
     category = data.get("category", "general")
     
-    # Get organization ID and user ID from authenticated user
-    organization_id = utils.get_user_organization_id()
+    # Only messages added or changed since the last save are sent; older
+    # clients send the whole conversation as "messages"
+    new_messages = data.get("new_messages")
+    if new_messages is None:
+        new_messages = data.get("messages", [])
     
     # Log the auth header for debugging
-    auth_header = request.headers.get('Authorization')
-    logger.info(f"Auth header present: {bool(auth_header)}")
-    if auth_header:
-        logger.info(f"Auth header format valid: {auth_header.startswith('Bearer ')}")
+    if logger.isEnabledFor(logging.DEBUG):
+        auth_header = request.headers.get('Authorization')
+        logger.debug("Auth header present: %s, format valid: %s",
+                     bool(auth_header), bool(auth_header) and auth_header.startswith('Bearer '))
     
-    # Get user ID
-    user_id = utils.get_user_id()
+    # Get organization ID and user ID from authenticated user
+    organization_id, user_id, error = require_org_and_user("saving chat session")
+    if error:
+        return error
     
     logger.info(f"Organization ID: {organization_id}, User ID: {user_id}")
     
-    # Enforce organization ID requirement for multi-tenant isolation
-    if not organization_id:
-        logger.error("Organization ID is required for saving chat session")
-        return jsonify({"error": "Organization ID is required. Please ensure you are properly authenticated and assigned to an organization."}), 403
-    
-    if not user_id:
-        logger.error("User ID is required for saving chat session")
-        return jsonify({"error": "User ID is required. Please ensure you are properly authenticated."}), 403
-    
     try:
+        # Prepare session data
+        session_data = {
+            "title": title,
+            "category": category,
+            "updated_at": firestore.SERVER_TIMESTAMP
+        }
+        if new_messages:
+            session_data["last_message"] = new_messages[-1]["content"]
+        
+        messages_to_write = new_messages
+        
         # Create or update chat session
         if session_id:
             # Update existing session
             session_ref = db.collection("organizations").document(organization_id) \
                             .collection("users").document(user_id) \
                             .collection("chat_sessions").document(session_id)
+            session = session_ref.get()
+            existing_data = session.to_dict() if session.exists else None
+            if existing_data is None:
+                session_data["created_at"] = firestore.SERVER_TIMESTAMP
+            elif "messages" in existing_data:
+                # Move a legacy inline messages array into the subcollection
+                messages_to_write = existing_data["messages"] + new_messages
+                session_data["messages"] = firestore.DELETE_FIELD
         else:
             # Create new session
             session_ref = db.collection("organizations").document(organization_id) \
                             .collection("users").document(user_id) \
                             .collection("chat_sessions").document()
             session_id = session_ref.id
-        
-        # Prepare session data
-        last_message = messages[-1]["content"] if messages else ""
-        session_data = {
-            "title": title,
-            "messages": messages,
-            "category": category,
-            "last_message": last_message,
-            "updated_at": firestore.SERVER_TIMESTAMP
-        }
-        
-        # Add created_at for new sessions
-        if not session_ref.get().exists:
             session_data["created_at"] = firestore.SERVER_TIMESTAMP
         
-        # Save session
-        session_ref.set(session_data, merge=True)
+        # Append the new messages (stored as a subcollection so each save
+        # costs only the messages it adds), then save the session in the
+        # last batch, so a legacy inline array is only deleted once every
+        # copied message has been committed
+        batch = db.batch()
+        batch_writes = 0
+        messages_ref = session_ref.collection("messages")
+        for message in messages_to_write:
+            # Reuse the client message ID so a retried or updated message
+            # overwrites its earlier copy instead of duplicating it
+            message_id = message.get("id")
+            message_ref = messages_ref.document(str(message_id)) if message_id else messages_ref.document()
+            batch.set(message_ref, message)
+            batch_writes += 1
+            # Firestore batches are limited to 500 writes
+            if batch_writes == MAX_BATCH_WRITES:
+                batch.commit()
+                batch = db.batch()
+                batch_writes = 0
+        batch.set(session_ref, session_data, merge=True)
+        batch.commit()
         
         return jsonify({
             "message": "Chat session saved successfully",
@@ -280,23 +400,15 @@ def save_chat_session():
         })
     except Exception as e:
         logger.error(f"Save chat session error: {str(e)}")
-        return jsonify({"error": f"Failed to save chat session: {str(e)}"}), 500
+        return error_response(f"Failed to save chat session: {str(e)}", 500)
 
 @query_bp.route('/chat/session/<session_id>', methods=['GET'])
 def get_chat_session(session_id):
     """Get a specific chat session."""
     # Get organization ID and user ID from authenticated user
-    organization_id = utils.get_user_organization_id()
-    user_id = utils.get_user_id()
-    
-    # Enforce organization ID requirement for multi-tenant isolation
-    if not organization_id:
-        logger.error("Organization ID is required for retrieving chat session")
-        return jsonify({"error": "Organization ID is required. Please ensure you are properly authenticated and assigned to an organization."}), 403
-    
-    if not user_id:
-        logger.error("User ID is required for retrieving chat session")
-        return jsonify({"error": "User ID is required. Please ensure you are properly authenticated."}), 403
+    organization_id, user_id, error = require_org_and_user("retrieving chat session")
+    if error:
+        return error
     
     try:
         # Get chat session
@@ -306,21 +418,51 @@ def get_chat_session(session_id):
         session = session_ref.get()
         
         if not session.exists:
-            return jsonify({"error": "Chat session not found"}), 404
+            return error_response("Chat session not found", 404)
         
         session_data = session.to_dict()
         
-        return jsonify({
+        # Page through the messages subcollection
+        cursor = request.args.get("cursor")
+        try:
+            limit = min(int(request.args.get("limit", MESSAGES_PAGE_SIZE)), MAX_BATCH_WRITES)
+        except ValueError:
+            return error_response("Invalid limit", 400)
+        
+        # Skip reading messages when the client's copy of this page is current
+        etag = make_etag(session.id, session_data.get("updated_at"), cursor, limit)
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304)
+        
+        messages_query = session_ref.collection("messages").order_by("timestamp").limit(limit)
+        if cursor:
+            cursor_doc = session_ref.collection("messages").document(cursor).get()
+            if not cursor_doc.exists:
+                return error_response("Invalid cursor", 400)
+            messages_query = messages_query.start_after(cursor_doc)
+        
+        message_docs = list(messages_query.stream())
+        messages = [doc.to_dict() for doc in message_docs]
+        next_cursor = message_docs[-1].id if len(message_docs) == limit else None
+        
+        # Sessions saved before messages moved to a subcollection
+        if not messages and not cursor:
+            messages = session_data.get("messages", [])
+        
+        response = jsonify({
             "id": session.id,
             "title": session_data.get("title", "Untitled Chat"),
-            "messages": session_data.get("messages", []),
+            "messages": messages,
+            "next_cursor": next_cursor,
             "category": session_data.get("category", "general"),
             "updated_at": session_data.get("updated_at"),
             "created_at": session_data.get("created_at")
         })
+        response.set_etag(etag, weak=True)
+        return response
     except Exception as e:
         logger.error(f"Get chat session error: {str(e)}")
-        return jsonify({"error": f"Failed to retrieve chat session: {str(e)}"}), 500
+        return error_response(f"Failed to retrieve chat session: {str(e)}", 500)
 
 @query_bp.route('/evaluate', methods=['POST'])
 @limiter.limit("5 per minute")  # Strict limit for the evaluation endpoint
@@ -337,12 +479,9 @@ def evaluate_rag():
         test_cases = data.get("test_cases", [])
         
         # Get organization ID from authenticated user
-        organization_id = utils.get_user_organization_id()
-        
-        # Enforce organization ID requirement for multi-tenant isolation
-        if not organization_id:
-            logger.error("Organization ID is required for evaluation")
-            return jsonify({"error": "Organization ID is required. Please ensure you are properly authenticated and assigned to an organization."}), 403
+        organization_id, _, error = require_org_and_user("evaluation", require_user=False)
+        if error:
+            return error
         
         # Initialize evaluator
         evaluator = RAGEvaluator(
@@ -360,10 +499,10 @@ def evaluate_rag():
             # Single query evaluation
             result = evaluator.evaluate_query(query, expected_answer, category)
         else:
-            return jsonify({"error": "Invalid request parameters"}), 400
+            return error_response("Invalid request parameters", 400)
         
         return jsonify(result)
         
     except Exception as e:
         logger.error(f"Evaluation error: {str(e)}")
-        return jsonify({"error": f"Failed to evaluate: {str(e)}"}), 500
+        return error_response(f"Failed to evaluate: {str(e)}", 500)
@@ -21,6 +21,18 @@ PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "knowledge-hub-vecto
 # Initialize Pinecone client
 pinecone_client = PineconeClient(api_key=PINECONE_API_KEY, index_name=PINECONE_INDEX_NAME)
 
+# Index stats are cached briefly so frequent monitoring probes don't each hit Pinecone
+INDEX_STATS_TTL = 10  # seconds
+index_stats_cache = {"fetched_at": 0.0, "stats": None}
+
+def get_index_stats(refresh=False):
+    """Get Pinecone index stats, reusing a result fetched in the last INDEX_STATS_TTL seconds."""
+    now = time.monotonic()
+    if refresh or index_stats_cache["stats"] is None or now - index_stats_cache["fetched_at"] >= INDEX_STATS_TTL:
+        index_stats_cache["stats"] = pinecone_client.index.describe_index_stats()
+        index_stats_cache["fetched_at"] = now
+    return index_stats_cache["stats"]
+
 @utility_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for monitoring."""
@@ -52,7 +64,7 @@ def detailed_health_check():
         db.collection("system_status").document("health").set({"last_check": firestore.SERVER_TIMESTAMP})
         
         # Pinecone check
-        index_stats = pinecone_client.index.describe_index_stats()
+        index_stats = get_index_stats()
         vector_count = index_stats.get("total_vector_count", 0)
         
         return jsonify({
@@ -74,36 +86,16 @@ def detailed_health_check():
 def test_pinecone():
     """Test endpoint to verify Pinecone connectivity."""
     try:
-        # Get index stats
-        stats = pinecone_client.index.describe_index_stats()
-        
-        # Create a test vector
-        test_vector_id = f"test_{int(time.time())}"
-        test_embedding = [0.1] * 1536  # Create a dummy vector 
-        test_metadata = {"test": True, "timestamp": time.time()}
-        
-        # Try to upsert
-        pinecone_client.index.upsert(
-            vectors=[(test_vector_id, test_embedding, test_metadata)],
-            namespace="test_namespace"
-        )
-        
-        # Try to query it back
-        query_result = pinecone_client.index.query(
-            vector=test_embedding,
-            top_k=1,
-            include_metadata=True,
-            namespace="test_namespace",
-            filter={"test": True}
-        )
-        
-        # Clean up test vector
-        pinecone_client.index.delete(ids=[test_vector_id], namespace="test_namespace")
+        # Read-only probe: a single live stats call, timed, with no test
+        # vectors written to (or left behind in) the index
+        start_time = time.monotonic()
+        stats = get_index_stats(refresh=True)
+        latency_ms = round((time.monotonic() - start_time) * 1000, 1)
         
         return jsonify({
             "status": "success",
             "index_stats": stats,
-            "test_query_result": query_result,
+            "latency_ms": latency_ms,
             "message": "Pinecone connection is working properly"
         })
     except Exception as e:
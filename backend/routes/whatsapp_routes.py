@@ -1,13 +1,20 @@
 import os
-import uuid
 import logging
 import re
 import json
-from flask import Blueprint, request, jsonify
+import hashlib
+import time
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait
+from cachetools import TTLCache
+import requests
+from flask import Blueprint, Response, request, jsonify
 from firebase_admin import firestore
-from rag_system import RAGSystem
+from routes.query_routes import get_rag_system
+import utils
 from utils import split_message_semantically
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from wati_client import get_wati_client
 
 # Configure logging
@@ -19,21 +26,94 @@ whatsapp_bp = Blueprint('whatsapp', __name__)
 # Get database instance
 db = firestore.client()
 
-# Message deduplication cache
-# Store message IDs with timestamps to prevent processing duplicates
-# Format: {message_id: timestamp}
-processed_messages = {}
-# How long to keep messages in the deduplication cache (in hours)
+# How long to remember processed message IDs for deduplication (in hours)
 MESSAGE_CACHE_HOURS = 24
+# How long a message ID stays claimed while it is queued and processed (long
+# enough for a full message queue to drain); the claim is extended to
+# MESSAGE_CACHE_HOURS once processing finishes, so a message lost to a worker
+# restart is accepted again when the sender redelivers it
+MESSAGE_CLAIM_SECONDS = 900
+# Upper bound on message IDs remembered by the in-process fallback
+MESSAGE_CACHE_MAX = 50000
+# In-process deduplication, used only when Redis is not configured or unavailable
+# (Redis covers all workers); expired IDs are dropped by the cache itself
+processed_messages = TTLCache(maxsize=MESSAGE_CACHE_MAX, ttl=MESSAGE_CACHE_HOURS * 3600)
+processed_messages_lock = threading.Lock()
 
-# Get environment variables
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
-PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
-PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "knowledge-hub-vectors")
-WATI_API_URL = os.environ.get("WATI_API_URL")
-WATI_API_TOKEN = os.environ.get("WATI_API_TOKEN")
-WATI_WHATSAPP_NUMBER = os.environ.get("WATI_WHATSAPP_NUMBER")
+# Short-lived caches for member lookups by phone and organization names,
+# which change rarely but are read on every inbound message
+MEMBER_CACHE_TTL = 60  # seconds
+ORG_NAME_CACHE_TTL = 900  # seconds (names are set at creation and not edited through the API)
+member_cache = TTLCache(maxsize=10000, ttl=MEMBER_CACHE_TTL)
+CACHE_MISS = object()  # Distinguishes a cache miss from a cached None (unknown number, unnamed org)
+org_name_cache = TTLCache(maxsize=1000, ttl=ORG_NAME_CACHE_TTL)
+cache_lock = threading.RLock()
+
+# Recent exchanges passed to the RAG system as conversation history, cached
+# in Redis (shared by every worker) when it is configured
+HISTORY_EXCHANGES = 5
+HISTORY_CACHE_TTL = 600  # seconds
+# History is optional context, so a slow read is abandoned rather than delaying the answer
+HISTORY_READ_TIMEOUT = 2  # seconds
+
+# Exchanges older than the most recent few are replaced by a short summary,
+# keyed by a digest of the exchanges it covers
+HISTORY_VERBATIM_EXCHANGES = 2
+HISTORY_SUMMARY_CACHE_TTL = 3600  # seconds
+history_summary_cache = TTLCache(maxsize=10000, ttl=HISTORY_SUMMARY_CACHE_TTL)
+# Summaries are LLM calls taking seconds, so they run on their own small pool
+# rather than the shared background pool that history reads wait on; each
+# member has at most one summary queued, for their latest exchanges
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+HISTORY_SUMMARY_QUEUE_MAX = 200
+# Format: {member_id: latest exchanges to summarize, or None once taken}
+pending_summaries = {}
+
+# Member fields read by the webhook and verification flow
+MEMBER_LOOKUP_FIELDS = [
+    'organizationId', 'whatsappVerified', 'verificationCode', 'verificationExpiry', 'verificationExpiryTs',
+    'verificationSent', 'verificationSentAt'
+]
+
+# Seconds to wait for an answer before telling the sender we are still searching
+PROGRESS_MESSAGE_DELAY = 2.0
+
+# Firestore limit on writes per batch
+MAX_BATCH_WRITES = 500
+
+# Verification codes are exactly 6 digits
+VERIFICATION_CODE_PATTERN = re.compile(r'\b([0-9]{6})\b')
+# Longer messages are treated as queries without searching them for a code
+VERIFICATION_MESSAGE_MAX_CHARS = 200
+# Words (4+ letters) that can accompany a code; any other word marks a query
+VERIFICATION_WORD_PATTERN = re.compile(r'[A-Za-z]{4,}')
+VERIFICATION_WORDS = frozenset({'code', 'verify', 'verification', 'verified', 'here', 'this', 'number'})
+
+# Markup sanitize_ai_response strips from AI replies, as one pattern so the
+# reply is scanned once: code blocks, links (keeping their text), HTML tags
+# and header markers
+SANITIZE_PATTERN = re.compile(
+    r'```[\s\S]+?```'
+    r'|\[(.+?)\]\(.+?\)'
+    r'|<[^>]+>'
+    r'|^#+ +',
+    re.MULTILINE
+)
+# Characters that might trigger WhatsApp filters (this also drops leftover
+# markdown such as *, _ and `), with a translate table for ASCII replies
+SPECIAL_CHARS_PATTERN = re.compile(r'[^\w\s.,;:!?()\-+\'\"\/]')
+SPECIAL_CHARS_TABLE = {c: None for c in range(128) if SPECIAL_CHARS_PATTERN.match(chr(c))}
+EXCESS_WHITESPACE_PATTERN = re.compile(r'\n{3,}| {2,}')
+
+# Send WhatsApp answers in parts while they are generated (opt-in, since
+# WhatsApp does not guarantee the delivery order of separate messages)
+STREAM_WHATSAPP_RESPONSES = os.environ.get('WHATSAPP_STREAM_RESPONSES', '').lower() == 'true'
+STREAM_FLUSH_CHARS = 300
+STREAM_MAX_PART_CHARS = 1500
+STREAM_PART_DELIMITERS = ('. ', '? ', '! ', '\n')
+# A streamed part is only sent if it has some word characters once sanitized
+# (not just a rule, stray markup or whitespace)
+STREAM_PART_TEXT_PATTERN = re.compile(r'\w')
 
 # Initialize WATI client
 try:
@@ -43,18 +123,95 @@ except Exception as e:
     logger.error(f"WATI initialization error: {str(e)}")
     wati_client = None
 
+def get_rag(organization_id):
+    """
+    Return the RAG system for an organization.
+    
+    WhatsApp queries use the custom RAGSystem API, and share the process-wide
+    instance /query uses for that backend instead of building their own.
+    """
+    return get_rag_system("custom", organization_id)
+
+# Serialized once: the webhooks acknowledge almost every delivery with this body
+WEBHOOK_ACK_BODY = b'{"status":"success"}'
+
+def webhook_ack():
+    """Build the 200 acknowledgement returned to the WhatsApp provider."""
+    return Response(WEBHOOK_ACK_BODY, status=200, mimetype='application/json')
+
+@lru_cache(maxsize=4096)
+def normalize_phone(phone_number):
+    """
+    Normalize a WhatsApp number once into both forms the code uses.
+    
+    Returns (wati_phone, member_phone): the WATI form without whatsapp: or +
+    prefix, and the form stored on member documents with a + prefix.
+    """
+    if phone_number.startswith('whatsapp:'):
+        phone_number = phone_number[9:]
+    if phone_number.startswith('+'):
+        phone_number = phone_number[1:]
+    return phone_number, f"+{phone_number}"
+
+def to_wati_phone(phone_number):
+    """Format a phone number for WATI (no whatsapp: or + prefix)."""
+    return normalize_phone(phone_number)[0]
+
+def to_member_phone(phone_number):
+    """Format a phone number as stored on member documents (with + prefix)."""
+    return normalize_phone(phone_number)[1]
+
+# Pool for sending the parts of a split message concurrently
+send_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="wati-send")
+
+# Pool for streamed answer parts, separate from send_executor since a part
+# long enough to be split waits on send_executor itself
+stream_send_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="wati-stream")
+
+def send_after(previous_send, to_number, message_body):
+    """Send a message once the previous send in the same sequence has finished."""
+    if previous_send is not None:
+        wait([previous_send])
+    return send_whatsapp_message(to_number, message_body)
+
+# Pool for processing inbound messages after the webhook has been acknowledged
+message_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('WHATSAPP_MESSAGE_WORKERS', 16)),
+    thread_name_prefix="wati-message"
+)
+# Cap on messages queued or running on message_executor; beyond it webhooks
+# are refused so the sender retries later instead of work piling up in memory
+MESSAGE_QUEUE_MAX = int(os.environ.get('WHATSAPP_MESSAGE_QUEUE_MAX', 256))
+message_slots = threading.BoundedSemaphore(MESSAGE_QUEUE_MAX)
+
+# Pool running RAG queries, so the message handler can stop waiting after a timeout
+rag_query_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('WHATSAPP_MESSAGE_WORKERS', 16)),
+    thread_name_prefix="rag-query"
+)
+RAG_QUERY_TIMEOUT = 60  # seconds
+
+# Pool for broadcast sends, kept under WATI's throughput with a shared rate limit
+broadcast_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="wati-broadcast")
+# Pool running whole broadcasts, which can take minutes; kept off the shared
+# background pool so they never hold threads other requests wait on
+broadcast_runner = ThreadPoolExecutor(max_workers=2, thread_name_prefix="broadcast-runner")
+BROADCAST_SENDS_PER_SECOND = float(os.environ.get('WHATSAPP_BROADCAST_SENDS_PER_SECOND', '50'))
+BROADCAST_MAX_ATTEMPTS = 3
+# Member fields a broadcast reads, and the page size for enumerating an organization's members
+BROADCAST_MEMBER_FIELDS = ['organizationId', 'whatsappVerified', 'phone', 'name']
+MEMBERS_PAGE_SIZE = 500
+
 def send_whatsapp_message(to_number, message_body):
     """
     Sends a WhatsApp message using the WATI client.
     If the message exceeds 1500 characters, it is split semantically into multiple parts.
+    Returns a plain status dict so it can also run off the request thread.
     """
     max_length = 1500
     
     # Format the phone number for WATI (remove + prefix if present)
-    if to_number.startswith('whatsapp:'):
-        to_number = to_number[9:]
-    if to_number.startswith('+'):
-        to_number = to_number[1:]
+    to_number = to_wati_phone(to_number)
     
     # Ensure message body is not empty
     if not message_body or message_body.strip() == "":
@@ -66,27 +223,42 @@ def send_whatsapp_message(to_number, message_body):
         message_body = str(message_body)
         logger.warning(f"Non-string message body provided, converted to string")
     
-    logger.info(f"Sending WhatsApp message to {to_number}, length: {len(message_body)}")
+    logger.info("Sending WhatsApp message to %s, length: %s", to_number, len(message_body))
     
     try:
         # Split the message semantically if it exceeds the max_length
         if len(message_body) > max_length:
-            logger.info(f"Message exceeds max length ({len(message_body)} > {max_length}), splitting into chunks")
+            logger.info("Message exceeds max length (%s > %s), splitting into chunks", len(message_body), max_length)
             chunks = split_message_semantically(message_body, max_length=max_length)
-            logger.info(f"Split message into {len(chunks)} chunks")
+            logger.info("Split message into %s chunks", len(chunks))
             
+            # Send the chunks concurrently; the part indicators let the
+            # recipient read them in order whichever arrives first
+            futures = []
             for i, chunk in enumerate(chunks):
-                logger.info(f"Sending chunk {i+1}/{len(chunks)}, length: {len(chunk)}")
+                logger.info("Sending chunk %s/%s, length: %s", i+1, len(chunks), len(chunk))
                 # Add chunk indicator for multiple messages
                 if len(chunks) > 1:
                     chunk = f"[Part {i+1}/{len(chunks)}] {chunk}"
-                response = wati_client.send_session_message(to_number, chunk)
-                logger.info(f"Chunk {i+1} sent, response: {response}")
+                futures.append(send_executor.submit(wati_client.send_session_message, to_number, chunk))
+            
+            errors = []
+            for i, future in enumerate(futures):
+                try:
+                    response = future.result()
+                    logger.info("Chunk %s sent, response: %s", i+1, response)
+                except Exception as chunk_error:
+                    logger.error(f"Error sending chunk {i+1}/{len(chunks)}: {str(chunk_error)}")
+                    errors.append(chunk_error)
+            
+            # Only fall back when no part got through
+            if len(errors) == len(futures):
+                raise errors[0]
         else:
             response = wati_client.send_session_message(to_number, message_body)
-            logger.info(f"Message sent, response: {response}")
+            logger.info("Message sent, response: %s", response)
         
-        return jsonify({'status': 'success'}), 200
+        return {'status': 'success'}
     except Exception as e:
         logger.error(f"Error sending WhatsApp message: {str(e)}")
         
@@ -97,10 +269,10 @@ def send_whatsapp_message(to_number, message_body):
             simple_message = "Message from Knowledge Hub. Please check the web interface for complete information."
             wati_client.send_session_message(to_number, simple_message)
             logger.info("Fallback message sent successfully")
-            return jsonify({'status': 'partial_success', 'message': 'Sent fallback message'}), 200
+            return {'status': 'partial_success', 'message': 'Sent fallback message'}
         except Exception as fallback_error:
             logger.error(f"Fallback also failed: {str(fallback_error)}")
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return {'status': 'error', 'message': str(e)}
 
 def send_whatsapp_template_message(to_number, template_name, parameters):
     """
@@ -112,30 +284,18 @@ def send_whatsapp_template_message(to_number, template_name, parameters):
       - parameters: A list of dicts with name and value for template parameters.
     """
     # Format the phone number for WATI (remove + prefix if present)
-    if to_number.startswith('whatsapp:'):
-        to_number = to_number[9:]
-    if to_number.startswith('+'):
-        to_number = to_number[1:]
-    
-    # Validate parameters
-    validated_parameters = []
-    for param in parameters:
-        if 'name' in param and 'value' in param:
-            # Ensure value is not empty
-            if not param['value'] or str(param['value']).strip() == "":
-                logger.warning(f"Empty parameter value for {param['name']}, using placeholder")
-                param['value'] = "No content available"
-            validated_parameters.append(param)
-        else:
-            logger.warning(f"Skipping invalid parameter: {param}")
+    to_number = to_wati_phone(to_number)
     
-    logger.info(f"Sending template message '{template_name}' to {to_number}")
-    logger.info(f"Template parameters: {validated_parameters}")
+    # The WATI client validates the parameters (skipping invalid ones and
+    # filling empty values), so they are passed through as they are; the
+    # values can hold a full answer, so they are only logged at debug level
+    logger.info("Sending template message '%s' to %s", template_name, to_number)
+    logger.debug("Template parameters: %s", parameters)
     
     try:
-        response = wati_client.send_template_message(to_number, template_name, validated_parameters)
-        logger.info(f"Template message response: {response}")
-        return jsonify({'status': 'success'}), 200
+        response = wati_client.send_template_message(to_number, template_name, parameters)
+        logger.info("Template message response: %s", response)
+        return {'status': 'success'}
     except Exception as e:
         error_message = str(e)
         logger.error(f"Template error: {error_message}")
@@ -144,7 +304,7 @@ def send_whatsapp_template_message(to_number, template_name, parameters):
         try:
             # Extract the main content from parameters if possible
             content = None
-            for param in validated_parameters:
+            for param in parameters:
                 if param.get('name') == '1' or param.get('name') == '2':
                     content = param.get('value')
                     if content:
@@ -153,7 +313,7 @@ def send_whatsapp_template_message(to_number, template_name, parameters):
             if not content:
                 content = f"Message from {template_name} template: Sorry, we couldn't send the template message properly."
             
-            logger.info(f"Falling back to plain text message: {content[:50]}...")
+            logger.info("Falling back to plain text message: %s...", content[:50])
             return send_whatsapp_message(to_number, content)
         except Exception as fallback_error:
             logger.error(f"Error sending fallback message: {str(fallback_error)}")
@@ -162,60 +322,272 @@ def send_whatsapp_template_message(to_number, template_name, parameters):
             try:
                 simple_message = "Message from Knowledge Hub. Please check the web interface for complete information."
                 send_whatsapp_message(to_number, simple_message)
-                return jsonify({'status': 'partial_success', 'message': 'Sent simple fallback message'}), 200
+                return {'status': 'partial_success', 'message': 'Sent simple fallback message'}
             except:
-                return jsonify({'status': 'error', 'message': str(e)}), 500
+                return {'status': 'error', 'message': str(e)}
 
-def get_member_by_phone(phone_number):
-    """Get member data by phone number."""
-    # Clean the phone number (remove whatsapp: prefix if present)
-    if phone_number.startswith('whatsapp:'):
-        phone_number = phone_number[9:]
+def get_member_by_phone(phone_number, use_cache=True):
+    """
+    Get member data by phone number.
     
-    # Add + prefix if not present (for database lookup)
-    if not phone_number.startswith('+'):
-        phone_number = f"+{phone_number}"
+    Lookups (including unknown numbers) are cached for MEMBER_CACHE_TTL
+    seconds. Pass use_cache=False to read the member document fresh (the
+    result still refreshes the cache).
+    """
+    # Format with + prefix for database lookup
+    phone_number = to_member_phone(phone_number)
+    
+    if use_cache:
+        with cache_lock:
+            member_data = member_cache.get(phone_number, CACHE_MISS)
+        if member_data is not CACHE_MISS:
+            return member_data
     
-    # Query for member with this phone number
-    members_ref = db.collection('members').where('phone', '==', phone_number).limit(1)
+    # Query for member with this phone number, reading only the fields
+    # the webhook and verification flow use
+    members_ref = db.collection('members').where('phone', '==', phone_number) \
+        .select(MEMBER_LOOKUP_FIELDS).limit(1)
     members = list(members_ref.stream())
     
     if not members:
+        # Remember unknown numbers too, so repeated messages from them skip the query
+        with cache_lock:
+            member_cache[phone_number] = None
         return None
     
     member_doc = members[0]
     member_data = member_doc.to_dict()
     member_data['id'] = member_doc.id
     
+    with cache_lock:
+        member_cache[phone_number] = member_data
+    
     return member_data
 
+def invalidate_member(phone_number):
+    """Drop a cached member lookup after the member document changes."""
+    with cache_lock:
+        member_cache.pop(to_member_phone(phone_number), None)
+
+def get_organization_name(org_id, default):
+    """Get an organization's display name, cached for ORG_NAME_CACHE_TTL seconds."""
+    with cache_lock:
+        org_name = org_name_cache.get(org_id, CACHE_MISS)
+    if org_name is not CACHE_MISS:
+        return org_name or default
+    
+    # Only the name is needed, so skip transferring the rest of the document.
+    # A missing name is cached as None, since callers pass different defaults
+    org_doc = db.collection('organizations').document(org_id).get(field_paths=['name'])
+    org_name = org_doc.to_dict().get('name') if org_doc.exists else None
+    with cache_lock:
+        org_name_cache[org_id] = org_name
+    return org_name or default
+
+def history_cache_key(member_id):
+    """Redis key holding a member's recent [query, response] exchanges, oldest first."""
+    return f"wati:history:{member_id}"
+
+def get_history_exchanges(member_id):
+    """Get a member's recent [query, response] exchanges, oldest first, from Redis or Firestore."""
+    redis_client = utils.get_redis()
+    if redis_client is not None:
+        try:
+            cached = redis_client.lrange(history_cache_key(member_id), 0, -1)
+            if cached:
+                return [json.loads(item) for item in cached]
+        except Exception as e:
+            logger.warning(f"Error reading cached conversation history: {str(e)}")
+    
+    # Get the last queries for this member (served by the
+    # memberId/status/createdAt composite index), reading only
+    # the fields the history needs
+    history_query = db.collection('queries') \
+        .where('memberId', '==', member_id) \
+        .where('status', '==', 'completed') \
+        .order_by('createdAt', direction=firestore.Query.DESCENDING) \
+        .select(['query', 'response']) \
+        .limit(HISTORY_EXCHANGES)
+    
+    # Collect the exchanges as the documents stream in (newest first),
+    # then put them in oldest-first order in place
+    exchanges = []
+    for doc in history_query.stream(retry=None, timeout=HISTORY_READ_TIMEOUT):
+        doc_data = doc.to_dict()
+        if 'query' in doc_data and 'response' in doc_data:
+            exchanges.append([doc_data['query'], doc_data['response']])
+    exchanges.reverse()
+    
+    if redis_client is not None and exchanges:
+        try:
+            key = history_cache_key(member_id)
+            pipeline = redis_client.pipeline()
+            pipeline.delete(key)
+            pipeline.rpush(key, *[json.dumps(exchange) for exchange in exchanges])
+            pipeline.expire(key, HISTORY_CACHE_TTL)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Error caching conversation history: {str(e)}")
+    
+    return exchanges
+
+def record_history_exchange(member_id, query, response):
+    """Append a completed exchange to a member's cached history, if it is cached."""
+    redis_client = utils.get_redis()
+    if redis_client is None:
+        return
+    try:
+        # RPUSHX only appends to an existing list, so a partial history is never cached
+        key = history_cache_key(member_id)
+        pipeline = redis_client.pipeline()
+        pipeline.rpushx(key, json.dumps([query, response]))
+        pipeline.ltrim(key, -HISTORY_EXCHANGES, -1)
+        pipeline.expire(key, HISTORY_CACHE_TTL)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Error caching conversation history: {str(e)}")
+
+def format_history_exchanges(exchanges):
+    """Format [query, response] exchanges in the history format the RAG system expects."""
+    return "\n".join(f"User: {query}\nAI: {response}" for query, response in exchanges)
+
+def history_summary_key(member_id, exchanges):
+    """Cache key for the summary of a member's exchanges, derived from their content."""
+    digest = hashlib.sha256(json.dumps(exchanges).encode('utf-8')).hexdigest()
+    return f"wati:history-summary:{member_id}:{digest}"
+
+def get_history_summary(key):
+    """Get a cached history summary from memory or Redis."""
+    with cache_lock:
+        summary = history_summary_cache.get(key)
+    if summary is not None:
+        return summary
+    
+    redis_client = utils.get_redis()
+    if redis_client is not None:
+        try:
+            summary = redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Error reading cached history summary: {str(e)}")
+        if summary is not None:
+            summary = summary.decode('utf-8') if isinstance(summary, bytes) else summary
+            with cache_lock:
+                history_summary_cache[key] = summary
+    return summary
+
+def prepare_history_summary(rag, member_id, exchanges):
+    """Summarize the exchanges that the member's next query will not replay verbatim."""
+    older_exchanges = exchanges[-HISTORY_EXCHANGES:-HISTORY_VERBATIM_EXCHANGES]
+    if not older_exchanges:
+        return
+    
+    key = history_summary_key(member_id, older_exchanges)
+    if get_history_summary(key) is not None:
+        return
+    
+    try:
+        summary = rag.summarize_conversation(format_history_exchanges(older_exchanges))
+    except Exception as e:
+        logger.warning(f"Error summarizing conversation history: {str(e)}")
+        return
+    
+    with cache_lock:
+        history_summary_cache[key] = summary
+    redis_client = utils.get_redis()
+    if redis_client is not None:
+        try:
+            redis_client.set(key, summary, ex=HISTORY_SUMMARY_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Error caching history summary: {str(e)}")
+
+def schedule_history_summary(rag, member_id, exchanges):
+    """Queue a history summary for a member, replacing any not yet started."""
+    with cache_lock:
+        running = member_id in pending_summaries
+        if not running and len(pending_summaries) >= HISTORY_SUMMARY_QUEUE_MAX:
+            logger.info("History summary queue is full, skipping summary for member %s", member_id)
+            return
+        pending_summaries[member_id] = exchanges
+    if not running:
+        summary_executor.submit(run_history_summaries, rag, member_id)
+
+def run_history_summaries(rag, member_id):
+    """Summarize a member's latest queued exchanges until none are left."""
+    while True:
+        with cache_lock:
+            exchanges = pending_summaries.get(member_id)
+            if exchanges is None:
+                pending_summaries.pop(member_id, None)
+                return
+            pending_summaries[member_id] = None
+        try:
+            prepare_history_summary(rag, member_id, exchanges)
+        except Exception as e:
+            logger.warning(f"Error preparing history summary: {str(e)}")
+
+def get_conversation_history(member_id):
+    """Build a member's recent WhatsApp conversation history in the format the RAG system expects.
+    
+    Returns the history text and the [query, response] exchanges it was built from.
+    """
+    conversation_history = ""
+    exchanges = []
+    try:
+        exchanges = get_history_exchanges(member_id)
+        
+        if exchanges:
+            # Replay only the latest exchanges verbatim when the older ones have
+            # been summarized; the summary is prepared after the previous answer,
+            # so the full history is used until it is available
+            older_exchanges = exchanges[:-HISTORY_VERBATIM_EXCHANGES]
+            summary = None
+            if older_exchanges:
+                summary = get_history_summary(history_summary_key(member_id, older_exchanges))
+            
+            if summary:
+                recent_history = format_history_exchanges(exchanges[-HISTORY_VERBATIM_EXCHANGES:])
+                conversation_history = f"Summary of earlier conversation: {summary}\n{recent_history}"
+            else:
+                conversation_history = format_history_exchanges(exchanges)
+            logger.info("Retrieved conversation history with %s previous exchanges (summarized: %s)", len(exchanges), bool(summary))
+    except Exception as history_error:
+        logger.warning(f"Error retrieving conversation history: {str(history_error)}")
+        # Continue without history if there's an error
+    
+    return conversation_history, exchanges
+
+def strip_markup(match):
+    """Replace a SANITIZE_PATTERN match, keeping only the text of links."""
+    return match.group(1) or ''
+
+def collapse_whitespace(match):
+    """Shorten a run of newlines to a blank line, or a run of spaces to one space."""
+    return '\n\n' if match.group()[0] == '\n' else ' '
+
 def sanitize_ai_response(text):
     """Aggressively sanitize AI responses for WhatsApp messages."""
     if not text:
         return "Sorry, I couldn't generate a response. Please try again."
-        
-    # Remove markdown headers (# Header)
-    text = re.sub(r'^#+ +(.+)$', r'\1', text, flags=re.MULTILINE)
-    
-    # Remove markdown bold/italic
-    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
-    text = re.sub(r'\*(.+?)\*', r'\1', text)
-    
-    # Remove markdown links
-    text = re.sub(r'\[(.+?)\]\(.+?\)', r'\1', text)
-    
-    # Remove markdown code blocks and their content (can cause formatting issues)
-    text = re.sub(r'```[\s\S]+?```', '', text)
     
-    # Remove markdown inline code
-    text = re.sub(r'`(.+?)`', r'\1', text)
+    text = clean_ai_text(text)
     
-    # Remove HTML tags that might be in the response
-    text = re.sub(r'<[^>]+>', '', text)
+    # Final check to ensure we're not returning empty content
+    if not text:
+        return "I couldn't generate a response. Please try asking your question differently or contact your administrator."
+        
+    return text
+
+def clean_ai_text(text):
+    """Strip markup and special characters from AI text for WhatsApp, which may leave it empty."""
+    # Remove markdown and HTML in a single pass
+    text = SANITIZE_PATTERN.sub(strip_markup, text)
     
     # Remove special characters that might trigger WhatsApp filters
     # Keep only alphanumeric, basic punctuation, and common symbols
-    text = re.sub(r'[^\w\s.,;:!?()\-+\'\"\/]', '', text)
+    if text.isascii():
+        text = text.translate(SPECIAL_CHARS_TABLE)
+    else:
+        text = SPECIAL_CHARS_PATTERN.sub('', text)
     
     # Limit length to ensure it fits in WhatsApp message
     # WhatsApp has a limit of 4096 characters, but we'll use a lower limit
@@ -223,7 +595,7 @@ def sanitize_ai_response(text):
     max_length = 1500  # Increased from 1000 but still well below WhatsApp limit
     if len(text) > max_length:
         # Find a good breaking point (end of sentence)
-        break_point = text[:max_length].rfind('.')
+        break_point = text.rfind('.', 0, max_length)
         if break_point == -1 or break_point < max_length - 200:
             # If no good breaking point, just cut at max_length
             text = text[:max_length-3] + "..."
@@ -232,24 +604,59 @@ def sanitize_ai_response(text):
             text = text[:break_point+1] + " [Message truncated due to length]"
     
     # Remove excessive whitespace
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r' {2,}', ' ', text)
+    text = EXCESS_WHITESPACE_PATTERN.sub(collapse_whitespace, text)
     
     # Ensure there are no leading/trailing whitespaces
-    text = text.strip()
+    return text.strip()
+
+def next_stream_part(pending):
+    """
+    Split a complete part off streamed answer text, once enough has arrived.
     
-    # Final check to ensure we're not returning empty content
-    if not text:
-        return "I couldn't generate a response. Please try asking your question differently or contact your administrator."
-        
-    return text
+    Returns (part, rest), or (None, pending) while the text should keep
+    accumulating. Parts end at the last sentence or line break; a boundary
+    with only whitespace before it (such as a new paragraph's leading
+    newline) is not used, so no blank parts are split off.
+    """
+    if len(pending) < STREAM_FLUSH_CHARS:
+        return None, pending
+    boundary = max(pending.rfind(delimiter) for delimiter in STREAM_PART_DELIMITERS)
+    if boundary >= 0 and pending[:boundary + 1].strip():
+        return pending[:boundary + 1], pending[boundary + 1:]
+    if len(pending) >= STREAM_MAX_PART_CHARS:
+        return pending, ""
+    return None, pending
+
+def verification_expired(expiry_ts, expiry_str):
+    """
+    Check whether a verification code has expired.
+    
+    Uses the verificationExpiryTs epoch seconds when present, falling back to
+    the verificationExpiry stored with older codes (an ISO string, or a
+    datetime). An expiry that cannot be read is treated as expired, so the
+    member is asked for a new code rather than left without a reply.
+    """
+    if expiry_ts is not None:
+        return time.time() > expiry_ts
+    try:
+        expiry = expiry_str if isinstance(expiry_str, datetime) else datetime.fromisoformat(expiry_str)
+        # Older codes were stored as naive local times; compare like with like
+        now = datetime.now(expiry.tzinfo) if expiry.tzinfo else datetime.now()
+        return now > expiry
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid verification expiry {expiry_str!r}, treating the code as expired")
+        return True
 
 def handle_verification_code(from_number, message):
     """Handle verification code messages."""
+    # A verification message is a code with at most a few words around it
+    if len(message) > VERIFICATION_MESSAGE_MAX_CHARS:
+        return None
+    
     # Extract verification code (must be exactly 6 digits)
-    code_match = re.search(r'\b([0-9]{6})\b', message)
+    code_match = VERIFICATION_CODE_PATTERN.search(message)
     if not code_match:
-        logger.info(f"No verification code found in message: '{message}'")
+        logger.info("No verification code found in message: '%s'", message)
         return None
     
     # Additional check to ensure the message is primarily a verification code
@@ -259,39 +666,31 @@ def handle_verification_code(from_number, message):
     
     # If there's a lot of other text, this is probably not a verification attempt
     if len(message_without_code) > 20:  # If there's more than 20 chars of other text
-        logger.info(f"Message contains a 6-digit code but appears to be a regular query: '{message}'")
+        logger.info("Message contains a 6-digit code but appears to be a regular query: '%s'", message)
         return None
     
-    logger.info(f"Verification code extracted: {verification_code}")
-    
-    # Clean the phone number (remove whatsapp: prefix if present)
-    phone_number = from_number
-    if phone_number.startswith('whatsapp:'):
-        phone_number = phone_number[9:]
+    # Words like "please" or "order" mean a number in a question, not a code,
+    # so skip the member lookup for them
+    if any(word.lower() not in VERIFICATION_WORDS for word in VERIFICATION_WORD_PATTERN.findall(message_without_code)):
+        logger.info("Message contains a 6-digit code but appears to be a regular query: '%s'", message)
+        return None
     
-    # Format phone number with + prefix for database lookup
-    if not phone_number.startswith('+'):
-        phone_number = f"+{phone_number}"
+    logger.info("Verification code extracted: %s", verification_code)
     
-    # Query for member with this phone number
-    members_ref = db.collection('members').where('phone', '==', phone_number).limit(1)
-    members = list(members_ref.stream())
+    # Format phone number for WATI (no + prefix) and for database lookup (+ prefix)
+    wati_phone, phone_number = normalize_phone(from_number)
     
-    # Format phone number for WATI (remove + prefix)
-    wati_phone = phone_number
-    if wati_phone.startswith('+'):
-        wati_phone = wati_phone[1:]
+    # Look up the member, bypassing the cache since verification fields
+    # change when a new code is sent
+    member_data = get_member_by_phone(phone_number, use_cache=False)
     
-    if not members:
+    if not member_data:
         send_whatsapp_message(wati_phone, "Your number is not registered in our system. Please contact your organization administrator.")
         return True
     
-    member_doc = members[0]
-    member_data = member_doc.to_dict()
-    
     # Check if already verified
     if member_data.get('whatsappVerified'):
-        logger.info(f"Phone number {phone_number} is already verified")
+        logger.info("Phone number %s is already verified", phone_number)
         send_whatsapp_message(wati_phone, "Your WhatsApp number is already verified. You can start querying the knowledge base.")
         return True
     
@@ -303,25 +702,25 @@ def handle_verification_code(from_number, message):
     
     # Check if verification code matches and is not expired
     stored_code = member_data.get('verificationCode')
+    expiry_ts = member_data.get('verificationExpiryTs')
     expiry_str = member_data.get('verificationExpiry')
     
     # Log member data for debugging
-    logger.info(f"Member data for verification: {json.dumps({k: v for k, v in member_data.items() if k in ['verificationCode', 'verificationExpiry', 'verificationSent', 'verificationSentAt', 'whatsappVerified']})}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Member data for verification: %s", {
+            field: member_data.get(field) for field in MEMBER_LOOKUP_FIELDS if field != 'organizationId'
+        })
     
-    if not stored_code or not expiry_str:
+    if not stored_code or not (expiry_ts or expiry_str):
         logger.warning(f"No verification code or expiry found for {phone_number}")
         send_whatsapp_message(wati_phone, "Verification information not found. Please contact your organization administrator.")
         return True
     
     # Check if code is expired
-    try:
-        expiry = datetime.fromisoformat(expiry_str)
-        if datetime.now() > expiry:
-            logger.warning(f"Verification code expired for {phone_number}")
-            send_whatsapp_message(wati_phone, "Verification code has expired. Please contact your organization administrator for a new code.")
-            return True
-    except:
-        logger.warning(f"Invalid expiry format for {phone_number}: {expiry_str}")
+    if verification_expired(expiry_ts, expiry_str):
+        logger.warning(f"Verification code expired for {phone_number}")
+        send_whatsapp_message(wati_phone, "Verification code has expired. Please contact your organization administrator for a new code.")
+        return True
     
     # Check if code matches
     if verification_code != stored_code:
@@ -330,17 +729,13 @@ def handle_verification_code(from_number, message):
         return True
     
     # Code matches and is not expired, mark as verified
-    member_id = member_doc.id
-    logger.info(f"Verifying WhatsApp for member {member_id} with phone {phone_number}")
+    member_id = member_data['id']
+    logger.info("Verifying WhatsApp for member %s with phone %s", member_id, phone_number)
     
-    # Get organization name
+    # Get organization name in the background while the member is updated
     org_id = member_data.get('organizationId')
     org_name = "your organization"
-    if org_id:
-        org_doc = db.collection('organizations').document(org_id).get()
-        if org_doc.exists:
-            org_data = org_doc.to_dict()
-            org_name = org_data.get('name', org_name)
+    org_name_future = utils.submit_background(get_organization_name, org_id, org_name) if org_id else None
     
     # Update member as verified
     db.collection('members').document(member_id).update({
@@ -348,8 +743,12 @@ def handle_verification_code(from_number, message):
         'status': 'active',
         'verifiedAt': firestore.SERVER_TIMESTAMP
     })
+    invalidate_member(phone_number)
     
-    logger.info(f"WhatsApp verification successful for member {member_id}")
+    if org_name_future is not None:
+        org_name = org_name_future.result() or org_name
+    
+    logger.info("WhatsApp verification successful for member %s", member_id)
     
     # Send welcome message using template
     try:
@@ -363,269 +762,341 @@ def handle_verification_code(from_number, message):
     
     return True
 
-# Send bulk WhatsApp messages to members
-@whatsapp_bp.route('/send-bulk-message', methods=['POST'])
-def send_bulk_message():
-    """Send a WhatsApp message to multiple members."""
+class SendRateLimiter:
+    """Space out sends so they stay under a per-second rate across threads."""
+    
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.next_send = 0.0
+        self.lock = threading.Lock()
+    
+    def wait(self):
+        """Block until the caller's send slot comes up."""
+        with self.lock:
+            send_at = max(time.monotonic(), self.next_send)
+            self.next_send = send_at + self.interval
+        delay = send_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+broadcast_rate_limiter = SendRateLimiter(BROADCAST_SENDS_PER_SECOND)
+
+def send_broadcast_message(wati_phone, message):
+    """Send one broadcast message within the shared send rate, backing off when WATI returns 429."""
+    for attempt in range(BROADCAST_MAX_ATTEMPTS):
+        broadcast_rate_limiter.wait()
+        try:
+            return wati_client.send_session_message(wati_phone, message)
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code != 429 or attempt == BROADCAST_MAX_ATTEMPTS - 1:
+                raise
+            logger.warning(f"WATI rate limited the send to {wati_phone}, retrying in {2 ** attempt}s")
+            time.sleep(2 ** attempt)
+
+def process_broadcast(broadcast_ref, organization_id, message, member_ids, members_by_id):
+    """Send a broadcast to its members and record the deliveries, off the request thread."""
+    broadcast_id = broadcast_ref.id
     try:
-        # Get the user ID from the request
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Unauthorized'}), 401
-        
-        token = auth_header.split(' ')[1]
-        
-        # Get the user from Firestore
-        users_ref = db.collection('users')
-        user_query = users_ref.where('auth_token', '==', token).limit(1).get()
-        
-        if not user_query:
-            return jsonify({'error': 'User not found'}), 404
-        
-        user_data = user_query[0].to_dict()
-        organization_id = user_data.get('organizationId')
-        
-        if not organization_id:
-            return jsonify({'error': 'User does not belong to an organization'}), 400
-        
-        # Get the message data from the request
-        data = request.json
-        
-        # Validate required fields
-        if not data.get('message'):
-            return jsonify({'error': 'Message is required'}), 400
-        
-        # Get the member IDs or filter criteria
-        member_ids = data.get('memberIds', [])
-        
-        # If no member IDs are provided, get all members for the organization
-        if not member_ids:
-            members_ref = db.collection('members')
-            members_query = members_ref.where('organizationId', '==', organization_id).get()
-            
-            member_ids = [doc.id for doc in members_query]
-        
-        if not member_ids:
-            return jsonify({'error': 'No members found for this organization'}), 404
+        # Record when sending started; heartbeatAt is refreshed with every committed
+        # batch, so a broadcast left 'processing' by a recycled worker can be found
+        broadcast_ref.update({
+            'startedAt': firestore.SERVER_TIMESTAMP,
+            'heartbeatAt': firestore.SERVER_TIMESTAMP
+        })
         
-        # Create a broadcast record
-        broadcast_id = str(uuid.uuid4())
-        broadcast_data = {
-            'title': data.get('title', 'Broadcast Message'),
-            'message': data.get('message'),
-            'organizationId': organization_id,
-            'senderId': user_query[0].id,
-            'senderName': user_data.get('fullName', 'Unknown'),
-            'senderRole': user_data.get('role', 'user'),
-            'recipientCount': len(member_ids),
-            'recipientIds': member_ids,
-            'deliveryMethods': {
-                'whatsapp': True,
-                'email': data.get('sendEmail', False),
-                'inApp': data.get('sendInApp', False)
-            },
-            'status': 'processing',
-            'createdAt': firestore.SERVER_TIMESTAMP,
-            'scheduledFor': data.get('scheduledFor'),
-            'hasAttachments': False
+        # Delivery record fields shared by every recipient
+        base_delivery = {
+            'broadcastId': broadcast_id,
+            'status': 'sent',
+            'sentAt': firestore.SERVER_TIMESTAMP,
+            'deliveryMethod': 'whatsapp'
         }
         
-        # Add the broadcast to Firestore
-        db.collection('broadcasts').document(broadcast_id).set(broadcast_data)
-        
-        # Send the message to each member
-        success_count = 0
-        failed_count = 0
-        results = []
-        
-        for member_id in member_ids:
+        def send_to_member(member_id):
+            """Send the broadcast to one member, returning its result and delivery record (or None)."""
             try:
-                # Get the member from Firestore
-                member_doc = db.collection('members').document(member_id).get()
+                # Get the prefetched member
+                member_data = members_by_id.get(member_id)
                 
-                if not member_doc.exists:
-                    results.append({
+                if member_data is None:
+                    return {
                         'memberId': member_id,
                         'status': 'failed',
                         'error': 'Member not found'
-                    })
-                    failed_count += 1
-                    continue
-                
-                member_data = member_doc.to_dict()
+                    }, None
                 
                 # Check if the member belongs to the user's organization
                 if member_data.get('organizationId') != organization_id:
-                    results.append({
+                    return {
                         'memberId': member_id,
                         'status': 'failed',
                         'error': 'Member does not belong to your organization'
-                    })
-                    failed_count += 1
-                    continue
+                    }, None
                 
                 # Check if the member has a verified WhatsApp number
                 if not member_data.get('whatsappVerified'):
-                    results.append({
+                    return {
                         'memberId': member_id,
                         'status': 'failed',
                         'error': 'Member does not have a verified WhatsApp number'
-                    })
-                    failed_count += 1
-                    continue
+                    }, None
                 
                 # Get the member's phone number
                 phone_number = member_data.get('phone')
                 
                 if not phone_number:
-                    results.append({
+                    return {
                         'memberId': member_id,
                         'status': 'failed',
                         'error': 'Member does not have a phone number'
-                    })
-                    failed_count += 1
-                    continue
+                    }, None
                 
                 # Format phone number for WATI (remove + prefix)
-                wati_phone = phone_number
-                if wati_phone.startswith('+'):
-                    wati_phone = wati_phone[1:]
+                wati_phone = to_wati_phone(phone_number)
                 
                 # Send the message
                 try:
                     # Format the message with personalization if needed
-                    personalized_message = data.get('message').replace('{name}', member_data.get('name', 'Member'))
+                    personalized_message = message.replace('{name}', member_data.get('name', 'Member'))
                     
                     # Send message using WATI
-                    wati_client.send_session_message(wati_phone, personalized_message)
+                    send_broadcast_message(wati_phone, personalized_message)
                     
                     # Record the successful delivery
-                    results.append({
+                    return {
                         'memberId': member_id,
                         'status': 'sent',
                         'phone': phone_number,
                         'method': 'session'
-                    })
-                    success_count += 1
-                    
-                    # Add a delivery record
-                    delivery_id = str(uuid.uuid4())
-                    delivery_data = {
-                        'broadcastId': broadcast_id,
+                    }, {
+                        **base_delivery,
                         'memberId': member_id,
                         'memberName': member_data.get('name', 'Unknown'),
-                        'memberPhone': phone_number,
-                        'status': 'sent',
-                        'sentAt': firestore.SERVER_TIMESTAMP,
-                        'deliveryMethod': 'whatsapp'
+                        'memberPhone': phone_number
                     }
-                    
-                    db.collection('broadcast_deliveries').document(delivery_id).set(delivery_data)
-                    
                 except Exception as e:
                     logger.error(f"Error sending WhatsApp message to {phone_number}: {str(e)}")
-                    results.append({
+                    return {
                         'memberId': member_id,
                         'status': 'failed',
                         'phone': phone_number,
                         'error': str(e)
-                    })
-                    failed_count += 1
+                    }, None
             except Exception as e:
                 logger.error(f"Error processing member {member_id}: {str(e)}")
-                results.append({
+                return {
                     'memberId': member_id,
                     'status': 'failed',
                     'error': str(e)
-                })
+                }, None
+        
+        # Send the message to each member concurrently, writing the delivery
+        # records in batches as sends complete (Firestore allows 500 writes
+        # per batch, one of which is the broadcast progress update), with
+        # the broadcast status update in the final batch
+        success_count = 0
+        failed_count = 0
+        failures = []
+        batch = db.batch()
+        deliveries_ref = db.collection('broadcast_deliveries')
+        
+        for result, delivery_data in broadcast_executor.map(send_to_member, member_ids):
+            if not delivery_data:
+                failures.append(result)
                 failed_count += 1
+                continue
+            
+            batch.set(deliveries_ref.document(), delivery_data)
+            success_count += 1
+            if success_count % (MAX_BATCH_WRITES - 1) == 0:
+                batch.update(broadcast_ref, {
+                    'heartbeatAt': firestore.SERVER_TIMESTAMP,
+                    'stats': {
+                        'success': success_count,
+                        'failed': failed_count,
+                        'total': len(member_ids)
+                    }
+                })
+                batch.commit()
+                batch = db.batch()
         
         # Update the broadcast status
-        db.collection('broadcasts').document(broadcast_id).update({
+        batch.update(broadcast_ref, {
             'status': 'completed',
             'completedAt': firestore.SERVER_TIMESTAMP,
             'stats': {
                 'success': success_count,
                 'failed': failed_count,
                 'total': len(member_ids)
-            }
+            },
+            'failures': failures
         })
+        batch.commit()
+    except Exception as e:
+        logger.error(f"Error processing broadcast {broadcast_id}: {str(e)}")
+        try:
+            broadcast_ref.update({
+                'status': 'failed',
+                'error': str(e),
+                'completedAt': firestore.SERVER_TIMESTAMP
+            })
+        except Exception as update_error:
+            logger.error(f"Error marking broadcast {broadcast_id} as failed: {str(update_error)}")
+
+# Send bulk WhatsApp messages to members
+@whatsapp_bp.route('/send-bulk-message', methods=['POST'])
+def send_bulk_message():
+    """Send a WhatsApp message to multiple members."""
+    try:
+        # Get the user ID from the request
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        token = auth_header.split(' ')[1]
+        
+        # Get the user from Firestore (only the fields the broadcast uses)
+        users_ref = db.collection('users')
+        user_query = users_ref.where('auth_token', '==', token) \
+            .select(['organizationId', 'fullName', 'role']).limit(1).get()
+        
+        if not user_query:
+            return jsonify({'error': 'User not found'}), 404
+        
+        user_data = user_query[0].to_dict()
+        organization_id = user_data.get('organizationId')
+        
+        if not organization_id:
+            return jsonify({'error': 'User does not belong to an organization'}), 400
+        
+        # Get the message data from the request
+        data = request.json
+        
+        # Validate required fields
+        if not data.get('message'):
+            return jsonify({'error': 'Message is required'}), 400
+        
+        # Get the member IDs or filter criteria
+        member_ids = data.get('memberIds', [])
+        
+        # If no member IDs are provided, get all members for the organization
+        if not member_ids:
+            # Page through the members, fetching only the fields the broadcast reads
+            members_query = db.collection('members') \
+                .where('organizationId', '==', organization_id) \
+                .select(BROADCAST_MEMBER_FIELDS).limit(MEMBERS_PAGE_SIZE)
+            members_by_id = {}
+            while True:
+                docs = members_query.get()
+                members_by_id.update((doc.id, doc.to_dict()) for doc in docs)
+                if len(docs) < MEMBERS_PAGE_SIZE:
+                    break
+                members_query = members_query.start_after(docs[-1])
+            
+            member_ids = list(members_by_id)
+        else:
+            # Fetch all requested members in one batched read
+            member_refs = [db.collection('members').document(member_id) for member_id in member_ids]
+            members_by_id = {doc.id: doc.to_dict()
+                             for doc in db.get_all(member_refs, field_paths=BROADCAST_MEMBER_FIELDS)
+                             if doc.exists}
+        
+        if not member_ids:
+            return jsonify({'error': 'No members found for this organization'}), 404
+        
+        # Create a broadcast record
+        broadcast_ref = db.collection('broadcasts').document()
+        broadcast_id = broadcast_ref.id
+        broadcast_data = {
+            'title': data.get('title', 'Broadcast Message'),
+            'message': data.get('message'),
+            'organizationId': organization_id,
+            'senderId': user_query[0].id,
+            'senderName': user_data.get('fullName', 'Unknown'),
+            'senderRole': user_data.get('role', 'user'),
+            'recipientCount': len(member_ids),
+            'recipientIds': member_ids,
+            'deliveryMethods': {
+                'whatsapp': True,
+                'email': data.get('sendEmail', False),
+                'inApp': data.get('sendInApp', False)
+            },
+            'status': 'processing',
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'scheduledFor': data.get('scheduledFor'),
+            'hasAttachments': False
+        }
+        
+        # Add the broadcast to Firestore
+        broadcast_ref.set(broadcast_data)
+        
+        # Send in the background and let the client follow the broadcast record
+        broadcast_runner.submit(process_broadcast, broadcast_ref, organization_id,
+                                data.get('message'), member_ids, members_by_id)
         
         return jsonify({
             'success': True,
             'broadcastId': broadcast_id,
-            'stats': {
-                'success': success_count,
-                'failed': failed_count,
-                'total': len(member_ids)
-            },
-            'results': results
-        })
+            'status': 'processing',
+            'totalCount': len(member_ids)
+        }), 202
     except Exception as e:
         logger.error(f"Error sending bulk message: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-# Clean up old entries from the message deduplication cache
-def clean_message_cache():
-    """Remove old entries from the message deduplication cache."""
-    current_time = datetime.now()
-    expired_keys = []
-    
-    for message_id, timestamp in processed_messages.items():
-        # Check if the entry is older than MESSAGE_CACHE_HOURS
-        if current_time - timestamp > timedelta(hours=MESSAGE_CACHE_HOURS):
-            expired_keys.append(message_id)
+def mark_message_processed(message_id):
+    """Claim a message ID for processing, returning False if it was already claimed."""
+    # With Redis configured, one atomic SET NX with expiry covers every worker process
+    redis_client = utils.get_redis()
+    if redis_client is not None:
+        try:
+            return bool(redis_client.set(f"wati:msg:{message_id}", 1, nx=True, ex=MESSAGE_CLAIM_SECONDS))
+        except Exception as e:
+            logger.warning(f"Redis deduplication failed, using the in-process cache: {str(e)}")
     
-    # Remove expired keys
-    for key in expired_keys:
-        processed_messages.pop(key, None)
+    with processed_messages_lock:
+        if message_id in processed_messages:
+            return False
+        processed_messages[message_id] = True
+    return True
+
+def confirm_message_processed(message_id):
+    """Keep a processed message's claim for MESSAGE_CACHE_HOURS so redeliveries are skipped."""
+    redis_client = utils.get_redis()
+    if redis_client is not None:
+        try:
+            redis_client.set(f"wati:msg:{message_id}", 1, ex=MESSAGE_CACHE_HOURS * 3600)
+        except Exception as e:
+            logger.warning(f"Error extending message deduplication claim: {str(e)}")
+
+def release_message_claim(message_id):
+    """Drop a message's claim so a redelivery of it is processed."""
+    redis_client = utils.get_redis()
+    if redis_client is not None:
+        try:
+            redis_client.delete(f"wati:msg:{message_id}")
+        except Exception as e:
+            logger.warning(f"Error releasing message deduplication claim: {str(e)}")
     
-    if expired_keys:
-        logger.info(f"Cleaned {len(expired_keys)} expired entries from message cache")
+    with processed_messages_lock:
+        processed_messages.pop(message_id, None)
 
-# WATI webhook handler
-@whatsapp_bp.route('/wati-webhook', methods=['POST'])
-def wati_webhook():
-    """Handle incoming WhatsApp messages from WATI."""
+def process_incoming_message(data):
+    """Process a deduplicated WATI webhook payload: verification codes and knowledge base queries."""
     try:
-        # Clean up old entries from the message cache
-        clean_message_cache()
-        
-        # Get the webhook data
-        data = request.json
-        logger.info(f"Received WATI webhook: {data}")
-        
-        # Extract message data - WATI webhook format
-        if not data:
-            logger.warning("No data in webhook")
-            return jsonify({'status': 'success'}), 200
-        
-        # Get message ID for deduplication
-        message_id = data.get('id')
-        if not message_id:
-            logger.warning("No message ID in webhook data")
-            # Continue processing as we can't deduplicate without an ID
-        else:
-            # Check if we've already processed this message
-            if message_id in processed_messages:
-                logger.info(f"Skipping already processed message: {message_id}")
-                return jsonify({'status': 'success'}), 200
-            
-            # Mark this message as processed
-            processed_messages[message_id] = datetime.now()
-            
         # Handle different webhook event types
         event_type = data.get('eventType', '')
         
         # For template message events, we don't need to process them
         if event_type == 'templateMessageSent':
-            logger.info(f"Received template message event, no action needed")
-            return jsonify({'status': 'success'}), 200
+            logger.info("Received template message event, no action needed")
+            return
             
         # For message status updates, we don't need to process them
         if event_type == 'messageStatusUpdate' or event_type == 'messageStatus':
-            logger.info(f"Received message status update, no action needed")
-            return jsonify({'status': 'success'}), 200
+            logger.info("Received message status update, no action needed")
+            return
             
         # For incoming messages
         if event_type == 'message':
@@ -644,209 +1115,206 @@ def wati_webhook():
                         logger.warning(f"Converted non-string text to string: {message_body}")
                     except:
                         logger.warning("Could not convert text field to string")
-                        return jsonify({'status': 'success'}), 200
+                        return
             else:
                 logger.warning("No text in webhook data")
-                return jsonify({'status': 'success'}), 200
+                return
                 
             from_number = data.get('waId', '')
         
         if not message_body or not from_number:
             logger.warning("Missing message body or sender number")
-            return jsonify({'status': 'success'}), 200
+            return
+        
+        logger.info("Processing message from %s: %s", from_number, message_body)
         
-        logger.info(f"Processing message from {from_number}: {message_body}")
+        # Format phone number for WATI (no + prefix) and for database lookup (+ prefix)
+        wati_phone, member_phone = normalize_phone(from_number)
         
         # Check if this is a verification code
-        verification_response = handle_verification_code(from_number, message_body)
+        verification_response = handle_verification_code(member_phone, message_body)
         if verification_response:
-            return jsonify({'status': 'success'}), 200
+            return
         
         # Get the member by phone number
-        member = get_member_by_phone(from_number)
+        member = get_member_by_phone(member_phone)
         
         if not member:
             logger.warning(f"No member found for phone number: {from_number}")
-            # Format phone number for WATI (remove + prefix)
-            wati_phone = from_number
-            if wati_phone.startswith('+'):
-                wati_phone = wati_phone[1:]
-            
             # Send response using WATI
             send_whatsapp_message(wati_phone, "Your number is not registered in our system. Please contact your organization administrator.")
-            return jsonify({'status': 'success'}), 200
+            return
         
         # Check if the member is verified
         if not member.get('whatsappVerified'):
             logger.warning(f"Member {member['id']} with phone {from_number} is not verified")
-            # Format phone number for WATI (remove + prefix)
-            wati_phone = from_number
-            if wati_phone.startswith('+'):
-                wati_phone = wati_phone[1:]
-            
             # Send response using WATI
             send_whatsapp_message(wati_phone, "Your WhatsApp number is not verified. Please contact your organization administrator.")
-            return jsonify({'status': 'success'}), 200
+            return
         
         # Get the organization ID
         organization_id = member.get('organizationId')
         
         if not organization_id:
             logger.warning(f"Member {member['id']} does not belong to an organization")
-            # Format phone number for WATI (remove + prefix)
-            wati_phone = from_number
-            if wati_phone.startswith('+'):
-                wati_phone = wati_phone[1:]
-            
             send_whatsapp_message(wati_phone, "You are not associated with any organization. Please contact your administrator.")
-            return jsonify({'status': 'success'}), 200
+            return
+        
+        # Fetch the conversation history in the background while the
+        # organization name and RAG system are resolved
+        history_future = utils.submit_background(get_conversation_history, member['id'])
         
         # Get organization name for logging
         org_name = "Unknown Organization"
         try:
-            org_doc = db.collection('organizations').document(organization_id).get()
-            if org_doc.exists:
-                org_data = org_doc.to_dict()
-                org_name = org_data.get('name', 'Unknown Organization')
+            org_name = get_organization_name(organization_id, org_name)
         except Exception as e:
             logger.error(f"Error fetching organization data: {str(e)}")
         
-        logger.info(f"Processing WhatsApp query for organization: {org_name} (ID: {organization_id})")
+        logger.info("Processing WhatsApp query for organization: %s (ID: %s)", org_name, organization_id)
+        
+        # Get the cached RAG system for this organization
+        rag = get_rag(organization_id)
         
-        # Initialize RAG system with organization ID
-        rag = RAGSystem(
-            openai_api_key=OPENAI_API_KEY,
-            anthropic_api_key=ANTHROPIC_API_KEY,
-            pinecone_api_key=PINECONE_API_KEY,
-            index_name=PINECONE_INDEX_NAME,
-            organization_id=organization_id
+        # Only send a progress message if the answer takes a while; most
+        # replies arrive first and the extra WATI call is skipped
+        progress_timer = threading.Timer(
+            PROGRESS_MESSAGE_DELAY, send_whatsapp_message,
+            args=(wati_phone, "Searching through our knowledge base...")
         )
+        progress_timer.daemon = True
         
-        # Format phone number for WATI (remove + prefix)
-        wati_phone = from_number
-        if wati_phone.startswith('+'):
-            wati_phone = wati_phone[1:]
+        # The query record is written once, with its outcome, so the receipt
+        # time is captured here rather than as a server timestamp at write time
+        query_ref = db.collection('queries').document()
+        query_data = {
+            'memberId': member['id'],
+            'organizationId': organization_id,
+            'query': message_body,
+            'source': 'whatsapp',
+            'createdAt': datetime.now(timezone.utc)
+        }
         
-        # Send an intermediate message to indicate processing
         try:
-            send_whatsapp_message(wati_phone, "Searching through our knowledge base...")
-            
-            # Add the query to the member's history
-            query_id = str(uuid.uuid4())
-            query_data = {
-                'memberId': member['id'],
-                'organizationId': organization_id,
-                'query': message_body,
-                'source': 'whatsapp',
-                'createdAt': firestore.SERVER_TIMESTAMP,
-                'status': 'processing'
-            }
-            
-            db.collection('queries').document(query_id).set(query_data)
+            progress_timer.start()
             
             # Query the knowledge base with enhanced RAG capabilities
-            import threading
-            import queue
-            import asyncio
-            from mcp_integration import enhance_rag_response
-
-            # Create a queue to hold the response
-            response_queue = queue.Queue()
+            from mcp_integration import enhance_rag_response, run_coroutine
             
-            # Get conversation history for this member
-            conversation_history = ""
+            # Wait for the conversation history fetched in the background,
+            # answering without it if it is not ready in time
             try:
-                # Get the last 5 queries for this member
-                history_query = db.collection('queries') \
-                    .where('memberId', '==', member['id']) \
-                    .where('status', '==', 'completed') \
-                    .order_by('createdAt', direction=firestore.Query.DESCENDING) \
-                    .limit(5)
+                conversation_history, history_exchanges = history_future.result(timeout=HISTORY_READ_TIMEOUT) or ("", [])
+            except FuturesTimeoutError:
+                logger.warning(f"Conversation history not ready after {HISTORY_READ_TIMEOUT} seconds, continuing without it")
+                conversation_history, history_exchanges = "", []
+            
+            # Stream the answer to WhatsApp in sentence-aligned parts as it is
+            # generated (skips MCP enhancement, which rewrites the full answer)
+            def run_streaming_query():
+                sent_parts = []
+                pending = ""
+                last_send = None
                 
-                history_docs = list(history_query.stream())
+                def send_part(part):
+                    nonlocal last_send
+                    sent_parts.append(part)
+                    # Parts holding only markup or whitespace are recorded but not sent
+                    text = clean_ai_text(part)
+                    if not STREAM_PART_TEXT_PATTERN.search(text):
+                        return
+                    progress_timer.cancel()
+                    # Send without pausing generation, each part after the previous one
+                    last_send = stream_send_executor.submit(
+                        send_after, last_send, wati_phone, text
+                    )
                 
-                # Format the history in the expected format for the RAG system
-                if history_docs:
-                    history_items = []
-                    for doc in reversed(history_docs):  # Oldest first
-                        doc_data = doc.to_dict()
-                        if 'query' in doc_data and 'response' in doc_data:
-                            history_items.append(f"User: {doc_data['query']}")
-                            history_items.append(f"AI: {doc_data['response']}")
-                    
-                    conversation_history = "\n".join(history_items)
-                    logger.info(f"Retrieved conversation history with {len(history_docs)} previous exchanges")
-            except Exception as history_error:
-                logger.warning(f"Error retrieving conversation history: {str(history_error)}")
-                # Continue without history if there's an error
+                def stream_callback(chunk):
+                    nonlocal pending
+                    pending += chunk
+                    part, pending = next_stream_part(pending)
+                    if part is not None:
+                        send_part(part)
+                
+                result = rag.query(
+                    user_query=message_body,
+                    user_id=member['id'],
+                    history=conversation_history,
+                    stream_callback=stream_callback
+                )
+                if pending.strip():
+                    send_part(pending)
+                if last_send is not None:
+                    last_send.result()
+                
+                # Cached and early-exit answers are returned instead of streamed
+                if sent_parts:
+                    result['answer'] = "".join(sent_parts)
+                    # If no part had any text to send, the answer is delivered
+                    # (with the usual fallback) like a non-streamed one
+                    result['streamed'] = last_send is not None
+                return result
             
-            # Define a function to run the query in a separate thread
+            # Define a function to run the query on the RAG query pool
             def run_query():
+                if STREAM_WHATSAPP_RESPONSES:
+                    return run_streaming_query()
+                
+                # First get the standard RAG response
+                standard_result = rag.query(
+                    user_query=message_body,
+                    user_id=member['id'],
+                    history=conversation_history
+                )
+                
+                # Then enhance it with the MCP server
                 try:
-                    # First get the standard RAG response
-                    standard_result = rag.query(
-                        user_query=message_body,
-                        user_id=member['id'],
-                        history=conversation_history
+                    # Run on the shared background event loop
+                    enhanced_result = run_coroutine(
+                        enhance_rag_response(
+                            query=message_body,
+                            existing_response=standard_result,
+                            conversation_history=conversation_history
+                        )
                     )
                     
-                    # Then enhance it with the MCP server
-                    try:
-                        # Use asyncio in a thread-safe way
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        
-                        enhanced_result = loop.run_until_complete(
-                            enhance_rag_response(
-                                query=message_body,
-                                existing_response=standard_result,
-                                conversation_history=conversation_history
-                            )
-                        )
-                        
-                        loop.close()
-                        
-                        # Use the enhanced result if available
-                        if enhanced_result and "answer" in enhanced_result:
-                            logger.info("Using enhanced RAG response")
-                            response_queue.put(("success", enhanced_result))
-                        else:
-                            # Fall back to standard result if enhancement fails
-                            logger.warning("Enhanced RAG failed, using standard response")
-                            response_queue.put(("success", standard_result))
-                    except Exception as enhance_error:
-                        # Log the error but continue with the standard result
-                        logger.warning(f"Error enhancing RAG response: {str(enhance_error)}")
-                        response_queue.put(("success", standard_result))
-                except Exception as e:
-                    response_queue.put(("error", str(e)))
-            
-            # Start the query in a separate thread
-            query_thread = threading.Thread(target=run_query)
-            query_thread.daemon = True
-            query_thread.start()
+                    # Use the enhanced result if available
+                    if enhanced_result and "answer" in enhanced_result:
+                        logger.info("Using enhanced RAG response")
+                        return enhanced_result
+                    
+                    # Fall back to standard result if enhancement fails
+                    logger.warning("Enhanced RAG failed, using standard response")
+                    return standard_result
+                except Exception as enhance_error:
+                    # Log the error but continue with the standard result
+                    logger.warning(f"Error enhancing RAG response: {str(enhance_error)}")
+                    return standard_result
             
             # Wait for the query to complete with a timeout
+            query_future = rag_query_executor.submit(run_query)
             try:
-                status, response = response_queue.get(timeout=60)  # 60 second timeout
-                if status == "error":
-                    raise Exception(response)
-            except queue.Empty:
-                # Timeout occurred
-                logger.error(f"RAG query timed out after 60 seconds for query: {message_body}")
-                db.collection('queries').document(query_id).update({
+                response = query_future.result(timeout=RAG_QUERY_TIMEOUT)
+                progress_timer.cancel()
+            except FuturesTimeoutError:
+                # Timeout occurred (the query is dropped if it has not started yet)
+                query_future.cancel()
+                logger.error(f"RAG query timed out after {RAG_QUERY_TIMEOUT} seconds for query: {message_body}")
+                utils.queue_set(query_ref, {
+                    **query_data,
                     'status': 'failed',
-                    'error': 'Query timed out after 60 seconds',
+                    'error': f'Query timed out after {RAG_QUERY_TIMEOUT} seconds',
                     'completedAt': firestore.SERVER_TIMESTAMP
                 })
                 send_whatsapp_message(wati_phone, "Sorry, your query is taking too long to process. Please try a simpler question or contact your administrator.")
-                return jsonify({'status': 'success'}), 200
+                return
             
             # Sanitize the response for WhatsApp
             sanitized_response = sanitize_ai_response(response.get('answer', ''))
             
-            # Update the query with the enhanced response
-            db.collection('queries').document(query_id).update({
+            # Add the query and its enhanced response to the member's history
+            utils.queue_set(query_ref, {
+                **query_data,
                 'response': response.get('answer', ''),
                 'sources': response.get('sources', []),
                 'reasoning_trace': response.get('reasoning_trace', []),
@@ -855,6 +1323,17 @@ def wati_webhook():
                 'status': 'completed',
                 'completedAt': firestore.SERVER_TIMESTAMP
             })
+            record_history_exchange(member['id'], message_body, response.get('answer', ''))
+            
+            # Summarize the turns the next query will no longer replay verbatim
+            schedule_history_summary(
+                rag, member['id'],
+                history_exchanges + [[message_body, response.get('answer', '')]]
+            )
+            
+            # Streamed answers have already been delivered
+            if response.get('streamed'):
+                return
             
             # Try to send as session message first (within 24-hour window)
             try:
@@ -879,13 +1358,13 @@ def wati_webhook():
                         "Sorry, we couldn't process your query. Please try again later."
                     )
             
-            return jsonify({'status': 'success'}), 200
-            
         except Exception as e:
             logger.error(f"Error querying knowledge base: {str(e)}")
+            progress_timer.cancel()
             
-            # Update the query with the error
-            db.collection('queries').document(query_id).update({
+            # Record the query with the error
+            utils.queue_set(query_ref, {
+                **query_data,
                 'status': 'failed',
                 'error': str(e),
                 'completedAt': firestore.SERVER_TIMESTAMP
@@ -896,8 +1375,74 @@ def wati_webhook():
                 wati_phone, 
                 "Sorry, we couldn't process your query. Please try again later or contact your administrator."
             )
-            
-            return jsonify({'status': 'success'}), 200
+    
+    except Exception as e:
+        logger.error(f"Error processing WATI message: {str(e)}")
+        raise
+
+def run_incoming_message(data):
+    """Process a queued payload, keeping its deduplication claim only if processing finished."""
+    message_id = data.get('id')
+    try:
+        process_incoming_message(data)
+    except Exception:
+        # Let the sender's redelivery of this message be processed
+        if message_id:
+            release_message_claim(message_id)
+        return
+    finally:
+        message_slots.release()
+    
+    if message_id:
+        confirm_message_processed(message_id)
+
+def accept_wati_payload(data):
+    """Deduplicate a WATI-format webhook payload and queue it for processing."""
+    # Get message ID for deduplication
+    message_id = data.get('id')
+    if not message_id:
+        logger.warning("No message ID in webhook data")
+        # Continue processing as we can't deduplicate without an ID
+    else:
+        # Mark this message as processed, skipping it if we already have
+        if not mark_message_processed(message_id):
+            logger.info("Skipping already processed message: %s", message_id)
+            return webhook_ack()
+    
+    # Refuse the message while the pool is full; the claim is dropped so the
+    # sender's retry is processed once there is room
+    if not message_slots.acquire(blocking=False):
+        logger.warning("WhatsApp message queue is full, asking the sender to retry")
+        if message_id:
+            release_message_claim(message_id)
+        return jsonify({'status': 'error', 'message': 'Server busy, please retry'}), 503
+    
+    # Process the message on the message pool so the sender gets its acknowledgement
+    # at once instead of waiting (and retrying) on Firestore, the RAG query and sends
+    try:
+        message_executor.submit(run_incoming_message, data)
+    except Exception:
+        message_slots.release()
+        if message_id:
+            release_message_claim(message_id)
+        raise
+    return webhook_ack()
+
+# WATI webhook handler
+@whatsapp_bp.route('/wati-webhook', methods=['POST'])
+def wati_webhook():
+    """Handle incoming WhatsApp messages from WATI."""
+    try:
+        # Get the webhook data
+        data = request.json
+        logger.info("Received WATI webhook: %s", data)
+        
+        # Extract message data - WATI webhook format
+        if not data:
+            logger.warning("No data in webhook")
+            return webhook_ack()
+        
+        return accept_wati_payload(data)
     
     except Exception as e:
         logger.error(f"Error handling WATI webhook: {str(e)}")
@@ -912,7 +1457,7 @@ def webhook():
         form_data = request.form.to_dict()
         
         # Log the incoming message
-        logger.info(f"Received Twilio webhook (legacy): {form_data}")
+        logger.info("Received Twilio webhook (legacy): %s", form_data)
         
         # Get the message body and sender
         message_body = form_data.get('Body', '').strip()
@@ -921,35 +1466,20 @@ def webhook():
         
         if not message_body or not from_number:
             logger.warning("Missing message body or sender number")
-            return jsonify({'status': 'success'}), 200
-        
-        # Check for message deduplication if we have a message ID
-        if message_sid:
-            # Clean up old entries from the message cache
-            clean_message_cache()
-            
-            # Check if we've already processed this message
-            if message_sid in processed_messages:
-                logger.info(f"Skipping already processed Twilio message: {message_sid}")
-                return jsonify({'status': 'success'}), 200
-            
-            # Mark this message as processed
-            processed_messages[message_sid] = datetime.now()
+            return webhook_ack()
         
-        # Redirect to WATI webhook handler
-        logger.info(f"Redirecting legacy Twilio webhook to WATI handler")
+        # Hand the message to the WATI processing path
+        logger.info("Redirecting legacy Twilio webhook to WATI handler")
         
         # Create a WATI-like webhook payload
         wati_data = {
             'text': message_body,
             'waId': from_number,
             'eventType': 'message',
-            'id': message_sid  # Include the message ID for deduplication in the WATI handler
+            'id': message_sid  # Twilio's message ID, used for deduplication
         }
         
-        # Call the WATI webhook handler with the transformed data
-        request._cached_json = (wati_data, request._cached_json[1] if hasattr(request, '_cached_json') else {})
-        return wati_webhook()
+        return accept_wati_payload(wati_data)
         
     except Exception as e:
         logger.error(f"Error handling legacy webhook: {str(e)}")
@@ -1,11 +1,129 @@
 import os
+import time
+import queue
+import atexit
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import request
 from werkzeug.utils import secure_filename
 from typing import Optional, Dict, Any, List
 
 logger = logging.getLogger(__name__)
 
+# Shared Redis connection (optional - falls back to in-process state when unset)
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+_redis_pool = None
+
+def get_redis_pool():
+    """Get the process-wide Redis connection pool, or None if Redis is not configured."""
+    global _redis_pool
+    if not REDIS_URL:
+        return None
+    if _redis_pool is None:
+        import redis
+        _redis_pool = redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+    return _redis_pool
+
+def get_redis():
+    """Get a Redis client on the shared connection pool, or None if Redis is not configured."""
+    pool = get_redis_pool()
+    if pool is None:
+        return None
+    import redis
+    return redis.Redis(connection_pool=pool)
+
+# Shared pool for fire-and-forget I/O (audit logs, status writes) off the request path
+_background_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BACKGROUND_WORKERS", 16)),
+    thread_name_prefix="background"
+)
+
+def submit_background(fn, *args, **kwargs):
+    """Run a function on the shared background pool, logging any exception it raises."""
+    def run():
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Background task {getattr(fn, '__qualname__', fn)} failed: {str(e)}")
+    return _background_executor.submit(run)
+
+# Fire-and-forget Firestore writes, coalesced into WriteBatches by one writer thread
+WRITE_BATCH_SIZE = 500  # Firestore limit per batch
+WRITE_FLUSH_SECONDS = 0.1
+_write_queue = queue.Queue()
+_write_thread_pid = None
+_write_thread_lock = threading.Lock()
+
+def _commit_writes(operations):
+    """Commit queued (method, ref, data, kwargs) operations in a single batch."""
+    from firebase_admin import firestore
+    batch = firestore.client().batch()
+    for method, ref, data, kwargs in operations:
+        getattr(batch, method)(ref, data, **kwargs)
+    try:
+        batch.commit()
+    except Exception as e:
+        logger.error(f"Batched Firestore write of {len(operations)} operations failed: {str(e)}")
+
+def _drain_writes():
+    """Collect queued writes for up to WRITE_FLUSH_SECONDS and commit them together."""
+    while True:
+        operations = [_write_queue.get()]
+        deadline = time.monotonic() + WRITE_FLUSH_SECONDS
+        while len(operations) < WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                operations.append(_write_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _commit_writes(operations)
+
+def _queue_operation(method, ref, data, **kwargs):
+    global _write_thread_pid
+    # Start the writer lazily in each worker (threads do not survive gunicorn's fork)
+    if _write_thread_pid != os.getpid():
+        with _write_thread_lock:
+            if _write_thread_pid != os.getpid():
+                threading.Thread(target=_drain_writes, name="firestore-writer", daemon=True).start()
+                _write_thread_pid = os.getpid()
+    _write_queue.put((method, ref, data, kwargs))
+
+def queue_set(ref, data, merge=False):
+    """Queue a Firestore document set without waiting for it to commit."""
+    _queue_operation("set", ref, data, merge=merge)
+
+def queue_update(ref, data):
+    """Queue a Firestore document update without waiting for it to commit.
+    
+    Writes are committed in order, so an update queued after the set that
+    creates its document is safe.
+    """
+    _queue_operation("update", ref, data)
+
+@atexit.register
+def _flush_writes():
+    """Commit writes still queued when the worker exits."""
+    operations = []
+    while True:
+        try:
+            operations.append(_write_queue.get_nowait())
+        except queue.Empty:
+            break
+    for start in range(0, len(operations), WRITE_BATCH_SIZE):
+        _commit_writes(operations[start:start + WRITE_BATCH_SIZE])
+
+def get_rate_limit_storage():
+    """Get the Flask-Limiter storage URI and options shared by all workers."""
+    pool = get_redis_pool()
+    if pool is None:
+        logger.warning("REDIS_URL not set, rate limits are tracked per worker in memory")
+        return "memory://", {}
+    return REDIS_URL, {"connection_pool": pool}
+
 def allowed_file(filename: str, allowed_extensions: set) -> bool:
     """Check if a file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
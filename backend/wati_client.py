@@ -2,6 +2,9 @@ import os
 import json
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
 from typing import Dict, List, Optional, Union, Any
 
 logger = logging.getLogger(__name__)
@@ -14,23 +17,31 @@ class WATIClient:
             'Authorization': f'Bearer {api_token}',
             'Content-Type': 'application/json'
         }
+        # Keep-alive connection pool shared by every request thread, sized for
+        # the concurrent send pools. Only failed connects are retried, since
+        # retrying a POST that reached WATI could send the message twice.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_maxsize=64,
+            max_retries=Retry(total=3, read=False, backoff_factor=0.2)
+        ))
     
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None, form_data: bool = False) -> Dict:
         """Make a request to the WATI API."""
         url = f"{self.api_url}/api/v1/{endpoint}"
         try:
-            logger.info(f"Making WATI API request: {method} {url}")
+            logger.info("Making WATI API request: %s %s", method, url)
             if data:
-                logger.info(f"Request data: {data}")
+                logger.info("Request data: %s", data)
             if params:
-                logger.info(f"Request params: {params}")
+                logger.info("Request params: %s", params)
             
             # Use form data or JSON based on the parameter
             if form_data:
-                logger.info(f"Using form data format")
+                logger.info("Using form data format")
                 headers = self.headers.copy()
                 headers['Content-Type'] = 'application/x-www-form-urlencoded'
-                response = requests.request(
+                response = self.session.request(
                     method=method,
                     url=url,
                     headers=headers,
@@ -38,7 +49,7 @@ class WATIClient:
                     params=params
                 )
             else:
-                response = requests.request(
+                response = self.session.request(
                     method=method,
                     url=url,
                     headers=self.headers,
@@ -46,14 +57,14 @@ class WATIClient:
                     params=params
                 )
             
-            logger.info(f"WATI API response status: {response.status_code}")
+            logger.info("WATI API response status: %s", response.status_code)
             
             # Log response content for debugging
             try:
                 response_data = response.json()
-                logger.info(f"WATI API response: {response_data}")
+                logger.info("WATI API response: %s", response_data)
             except:
-                logger.info(f"WATI API response (not JSON): {response.text[:200]}")
+                logger.info("WATI API response (not JSON): %s", response.text[:200])
             
             response.raise_for_status()
             return response.json()
@@ -88,7 +99,7 @@ class WATIClient:
             logger.warning("Attempted to send empty message, adding placeholder text")
             message_text = "No message content available."
         
-        logger.info(f"Sending session message to {phone_number}: {message_text[:50]}...")
+        logger.info("Sending session message to %s: %s...", phone_number, message_text[:50])
         
         # According to the Postman collection, this should be form data, not JSON
         form_data = {
@@ -136,7 +147,7 @@ class WATIClient:
             else:
                 logger.warning(f"Skipping invalid parameter: {param}")
         
-        logger.info(f"Sending template message '{template_name}' to {phone_number} with {len(validated_parameters)} parameters")
+        logger.info("Sending template message '%s' to %s with %s parameters", template_name, phone_number, len(validated_parameters))
         
         # According to the Postman collection, template messages use JSON format
         json_data = {
@@ -180,7 +191,7 @@ class WATIClient:
                         if param.get('name') and param.get('value'):
                             message_text += f"{param.get('value')} "
                     
-                    logger.info(f"Falling back to session message: {message_text[:50]}...")
+                    logger.info("Falling back to session message: %s...", message_text[:50])
                     return self.send_session_message(phone_number, message_text)
     
     def send_template_messages_bulk(self, template_name: str, receivers: List[Dict]) -> Dict:
@@ -198,8 +209,9 @@ class WATIClient:
         return self._make_request("GET", "getMessageTemplates")
 
 
+@lru_cache(maxsize=None)
 def get_wati_client():
-    """Helper function to get a configured WATI client."""
+    """Helper function to get the process-wide configured WATI client."""
     api_url = os.environ.get("WATI_API_URL")
     api_token = os.environ.get("WATI_API_TOKEN")
     
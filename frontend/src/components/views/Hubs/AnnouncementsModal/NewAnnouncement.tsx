@@ -140,7 +140,7 @@ const NewAnnouncement = () => {
       }
       
       // Show success notification
-      showNotification(`Message sent to ${response.data?.successCount || 0} members`);
+      showNotification(`Message queued for ${response.data?.totalCount || 0} members`);
       
       // Reset form
       setFormData({
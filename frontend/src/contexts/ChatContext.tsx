@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect, ReactNode } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef, ReactNode } from 'react';
 import { useAppContext } from './AppContext';
 import { useAuth, APP_EVENTS } from './AuthContext';
 import { useChat as useExistingChat } from '../hooks/useChat';
@@ -65,6 +65,12 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
   const [chatHistory, setChatHistory] = useState<ChatSession[]>([]);
   const [isLoading, setIsLoading] = useState(false);
   
+  // Content of each message as last saved, so saves only send new or changed messages
+  const savedMessagesRef = useRef<{ sessionId: string; contents: Map<string, string> }>({
+    sessionId: '',
+    contents: new Map()
+  });
+  
   // Get user and organization info from auth context
   const { user } = useAuth();
   const organizationId = user?.organizationId;
@@ -274,6 +280,12 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
       
       setChatCategory(session.category);
       
+      // Loaded messages are already saved
+      savedMessagesRef.current = {
+        sessionId,
+        contents: new Map(session.messages.map((msg: any) => [msg.id.toString(), msg.content]))
+      };
+      
       // Create or update thread
       const thread: ChatThread = {
         id: sessionId,
@@ -320,10 +332,23 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
       const sessionTitle = title || (activeThread ? activeThread.title : 
         chatMessages.length > 0 ? `Chat about ${chatMessages[0].content.substring(0, 30)}...` : 'Chat Session');
       
+      const sessionId = activeThread?.id !== 'default' ? activeThread?.id : undefined;
+      
+      // Only send messages that are new or changed since the last save of this session
+      const saved = savedMessagesRef.current;
+      const alreadySaved = sessionId !== undefined && saved.sessionId === sessionId;
+      const newMessages = alreadySaved
+        ? messages.filter(msg => saved.contents.get(msg.id) !== msg.content)
+        : messages;
+      
+      if (alreadySaved && newMessages.length === 0) {
+        return sessionId;
+      }
+      
       const response = await api.saveChatSession({
-        session_id: activeThread?.id !== 'default' ? activeThread?.id : undefined,
+        session_id: sessionId,
         title: sessionTitle,
-        messages,
+        new_messages: newMessages,
         category: chatCategory
       });
       
@@ -333,6 +358,11 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
       
       const sessionData = response.data || { session_id: '' };
       
+      // Remember what was saved for the next incremental save
+      const contents = alreadySaved ? saved.contents : new Map<string, string>();
+      newMessages.forEach(msg => contents.set(msg.id, msg.content));
+      savedMessagesRef.current = { sessionId: sessionData.session_id, contents };
+      
       // Update active thread with new ID if it was a new session
       if (!activeThread || activeThread.id === 'default') {
         const newThread: ChatThread = {
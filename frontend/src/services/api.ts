@@ -239,18 +239,32 @@ export async function getChatHistory(): Promise<ApiResponse<{sessions: any[]}>>
   });
 }
 
-// Get chat session
+// Get chat session (follows the message cursor until all pages are loaded)
 export async function getChatSession(sessionId: string): Promise<ApiResponse<any>> {
-  return fetchApi<any>(`/chat/session/${sessionId}`, {
+  const response = await fetchApi<any>(`/chat/session/${sessionId}`, {
     method: 'GET',
   });
+  
+  let cursor = response.data?.next_cursor;
+  while (response.data && cursor) {
+    const page = await fetchApi<any>(`/chat/session/${sessionId}?cursor=${encodeURIComponent(cursor)}`, {
+      method: 'GET',
+    });
+    if (page.error || !page.data) {
+      return page;
+    }
+    response.data.messages = response.data.messages.concat(page.data.messages);
+    cursor = page.data.next_cursor;
+  }
+  
+  return response;
 }
 
 // Save chat session
 export async function saveChatSession(data: {
   session_id?: string;
   title: string;
-  messages: any[];
+  new_messages: any[];
   category: string;
 }): Promise<ApiResponse<{session_id: string}>> {
   return fetchApi<{session_id: string}>('/chat/save', {
@@ -325,7 +339,7 @@ export async function sendWhatsAppVerification(memberId: string): Promise<ApiRes
   });
 }
 
-// Send bulk WhatsApp message to members
+// Send bulk WhatsApp message to members (queued; delivery continues on the server)
 export async function sendBulkWhatsAppMessage(data: {
   title: string;
   message: string;
@@ -337,17 +351,11 @@ export async function sendBulkWhatsAppMessage(data: {
   broadcastId: string;
   status: string;
   totalCount: number;
-  successCount: number;
-  failedCount: number;
-  results: any[];
 }>> {
   return fetchApi<{
     broadcastId: string;
     status: string;
     totalCount: number;
-    successCount: number;
-    failedCount: number;
-    results: any[];
   }>('/whatsapp/send-bulk-message', {
     method: 'POST',
     headers: {